@@ -7,38 +7,455 @@
 
 import sys
 import os
-from tkinter import Frame, N, S, E, W, Canvas, Scrollbar, Listbox,\
-    HORIZONTAL, VERTICAL, SINGLE, END, NW, SCROLL, UNITS
+import re
+import glob
+import argparse
+import json
+import time
+import threading
+import sqlite3
+import csv
+import bisect
+import contextlib
+import functools
+import queue
+import socket
+import getpass
+import hashlib
+import struct
+import io
+from tkinter import Frame, N, S, E, W, Canvas, Scrollbar, Listbox, Label,\
+    HORIZONTAL, VERTICAL, SINGLE, END, NW, SCROLL, UNITS, MOVETO
 from tkinter.font import Font
-from math import sqrt
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PIL.ImageTk import PhotoImage
 import PIL.Image
+import numpy
+
+# name of the folder, inside the dataset's root folder, where this tool keeps
+# its own bookkeeping files
+DATA_DIRNAME = '.ptagtool'
+
+# name of the scan manifest file, inside DATA_DIRNAME
+MANIFEST_FILENAME = 'manifest.json'
+
+# format version of the scan manifest file
+MANIFEST_VERSION = 3
+
+# directories modified less than this many seconds before a scan are not
+# trusted to be unchanged on the next scan (file-system mtime granularity)
+MANIFEST_MTIME_SLACK = 2.0
+
+# formats whose files may hold several images (the pages of a TIFF stack,
+# the frames of an animated GIF), each listed and tagged as an image of its own
+MULTI_FRAME_FORMATS = ('TIFF', 'GIF')
+
+# name of an image that is a frame of a multi-frame file: the file's name,
+# then the frame's page number in brackets - zero-padded so that the frames
+# of a file sort in order
+FRAME_FORMAT = '%s[%06d]'
+
+# matches the name of a frame, see FRAME_FORMAT
+FRAME_PATTERN = re.compile(r'^(.*)\[(\d+)\]$', re.DOTALL)
+
+# number of multi-frame files kept open, along with PIL's record of where
+# the pages seen so far start in them, so that seeking back to those is cheap
+NUM_OPEN_FRAME_FILES = 8
+
+# number of images, before and after the current one, that are decoded
+# and scaled in the background so that navigating to them is instant
+NUM_PREFETCH = 2
+
+# number of threads used to decode and scale images in the background
+NUM_PREFETCH_THREADS = 2
+
+# memory budget, in megabytes, for decoded and scaled images
+CACHE_MEGABYTES = 256
+
+# memory budget, in megabytes, for decoding a single image - formats that
+# support it (JPEG, JPEG 2000, TIFF with reduced-resolution pages) are
+# decoded at reduced resolution if their full resolution would not fit
+DECODE_MEGABYTES = 256
+
+# disk budget, in megabytes, for images scaled for display that are kept
+# across sessions, so that revisited images are not decoded again
+DISK_CACHE_MEGABYTES = 1024
+
+# JPEG quality of images scaled for display kept on disk
+DISK_CACHE_QUALITY = 90
+
+# modes of images scaled for display kept on disk as PNG, RGB and L ones
+# are kept as JPEG
+DISK_CACHE_PNG_MODES = ('1', 'LA', 'P', 'RGBA')
+
+# leading bytes of a file of the disk cache, followed by the original
+# image's width and height (little-endian 32-bit), then the scaled image
+DISK_CACHE_MAGIC = b'PTC1'
+
+# images are first shrunk by an integer factor, to no less than this many
+# times the display size, before being resized with BILINEAR - much faster
+# than BILINEAR alone for images much larger than the display
+RESIZE_REDUCING_GAP = 3.0
+
+# factor by which each zoom step magnifies or shrinks the shown image
+ZOOM_STEP = 1.25
+
+# largest magnification, relative to the whole image fitting the canvas
+MAX_ZOOM = 64.0
+
+# milliseconds that the canvas size, zoom and pan must stay the same before
+# the image is rendered at full quality - until then, a preview quickly
+# scaled from an image already decoded is shown
+RENDER_DELAY = 150
+
+# seconds between an edit and saving its points - all edits of an image
+# made within that time are saved together, in the background
+SAVE_DELAY = 0.5
+
+# seconds to wait for another process (e.g. a batch worker) to finish
+# writing to the SQLite annotation store
+SQLITE_TIMEOUT = 60.0
+
+# largest number of images looked up in the SQLite store by a single query,
+# SQLite limits the number of parameters of a query (999 in old versions)
+SQLITE_MAX_PARAMETERS = 500
+
+# number of images handed to a batch worker process at a time
+BATCH_CHUNKSIZE = 64
+
+# upper bounds, in seconds, of latency histogram buckets (0.05 ms to ~100 s)
+HISTOGRAM_BOUNDS = [0.00005*2**i for i in range(22)]
+
+# milliseconds between updates of the latency status line
+STATUS_INTERVAL = 500
+
+# name of the folder, inside DATA_DIRNAME, with a lock file for each image
+# claimed by an annotator
+CLAIMS_DIRNAME = 'claims'
+
+# seconds after its last renewal that a claim expires - claims of idle or
+# crashed annotators expire, and their images are handed out again
+CLAIM_TIMEOUT = 300.0
+
+# seconds between renewals of the claims of an annotator who is not idle
+CLAIM_RENEW_INTERVAL = 60.0
+
+# number of unlabeled images claimed at a time by each annotator
+CLAIM_BATCH_SIZE = 20
+
+# milliseconds between refreshes of the marks of visible images, which
+# other annotators may have labeled or claimed
+REFRESH_INTERVAL = 5000
+
+# radius, in decoded pixels, of the patch around each point of an image
+# that is looked for in the next image, when predicting its points
+MATCH_PATCH_RADIUS = 15
+
+# farthest, in decoded pixels, that a point is looked for from where it
+# was in the previous image
+MATCH_SEARCH_RADIUS = 24
+
+# predicted points whose patch matches worse than this (normalized
+# cross-correlation, 1 is a perfect match) stay where they were
+MIN_MATCH_SCORE = 0.8
+
+# milliseconds between checks for points predicted in the background
+PREDICT_POLL_INTERVAL = 50
+
+# maximum number of files being probed at a time during a scan, beyond
+# which the scan waits for probes to finish before listing more folders
+PROBE_BACKLOG = 1024
+
+# milliseconds between checks for images found by the background scan
+SCAN_POLL_INTERVAL = 100
+
+# milliseconds that navigation keys must rest before the image navigated
+# to is shown - key auto-repeat is faster, so holding a key down only
+# moves through the list, and only the image it stops on is decoded
+NAVIGATE_DELAY = 80
+
+# number of threads used to probe candidate image files - probing is
+# dominated by file-system latency (especially on NFS), not by CPU
+NUM_PROBE_THREADS = 16
+
+# number of bytes read from the start of a file to check its magic bytes
+MAGIC_HEADER_SIZE = 16
+
+# extensions of files that are never images, such as the .pts files of the
+# annotations - not worth opening to check their magic bytes
+NON_IMAGE_EXTENSIONS = frozenset([
+    '.pts', '.tmp', '.claim', '.txt', '.csv', '.json', '.xml', '.yaml',
+    '.yml', '.md', '.html', '.py', '.sh', '.npy', '.npz', '.db',
+    '.sqlite', '.log', '.zip', '.gz', '.tar',
+])
+
+# leading bytes of the image formats we commonly encounter - files whose
+# extension PIL does not know are only probed if they start with one of these
+IMAGE_MAGIC_PREFIXES = (
+    b'\xff\xd8\xff',                          # JPEG
+    b'\x89PNG\r\n\x1a\n',                     # PNG
+    b'GIF87a', b'GIF89a',                     # GIF
+    b'BM',                                    # BMP
+    b'II*\x00', b'MM\x00*',                   # TIFF
+    b'RIFF',                                  # WEBP
+    b'\x00\x00\x01\x00',                      # ICO
+    b'P1', b'P2', b'P3', b'P4', b'P5', b'P6', # PBM/PGM/PPM
+    b'8BPS',                                  # PSD
+    b'\x00\x00\x00\x0cjP  ',                  # JPEG 2000
+    b'\xffO\xffQ',                            # JPEG 2000 codestream
+)
+
+class LatencyHistogram(object):
+    """Counts of latencies in logarithmically spaced buckets"""
+    def __init__(self):
+        """Constructor"""
+        self.counts = [0]*(len(HISTOGRAM_BOUNDS)+1)
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        """Count one latency"""
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.last = seconds
+
+    def get_percentile(self, fraction):
+        """Returns upper bound of the bucket holding the given percentile"""
+        rank = fraction*sum(self.counts)
+        count = 0
+        for i, bucket_count in enumerate(self.counts):
+            count += bucket_count
+            if count >= rank and bucket_count > 0:
+                if i < len(HISTOGRAM_BOUNDS):
+                    return min(HISTOGRAM_BOUNDS[i], self.maximum)
+                return self.maximum
+        return 0.0
+
+    def get_report(self):
+        """Returns dict summarizing the histogram, times in milliseconds"""
+        num_calls = sum(self.counts)
+        return {'calls': num_calls,
+                'mean_ms': 1000.0*self.total/num_calls if num_calls else 0.0,
+                'p50_ms': 1000.0*self.get_percentile(0.5),
+                'p90_ms': 1000.0*self.get_percentile(0.9),
+                'p99_ms': 1000.0*self.get_percentile(0.99),
+                'max_ms': 1000.0*self.maximum,
+                'histogram': [{'le_ms': 1000.0*bound, 'count': count}
+                              for bound, count in zip(HISTOGRAM_BOUNDS,
+                                                      self.counts)]+
+                             [{'le_ms': None, 'count': self.counts[-1]}]}
+
+class LatencyProfiler(object):
+    """Times stages of the application's work, when enabled"""
+    def __init__(self, enabled=True):
+        """Constructor"""
+        self.enabled = enabled
+        # stages are timed from the Tk thread and from background threads
+        self.lock = threading.Lock()
+        # maps stage name to its LatencyHistogram, in order of first use
+        self.histograms = OrderedDict()
+        self.null_context = contextlib.nullcontext()
+
+    def stage(self, name):
+        """Returns context manager that times its body as the named stage"""
+        if not self.enabled:
+            return self.null_context
+        return self.time_stage(name)
+
+    @contextlib.contextmanager
+    def time_stage(self, name):
+        """Context manager that times its body as the named stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter()-start)
+
+    def record(self, name, seconds):
+        """Add a latency of the named stage"""
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].add(seconds)
+
+    def get_status(self):
+        """Returns one-line summary: last and 90th percentile latencies"""
+        with self.lock:
+            return '   '.join('%s %.1f ms (p90 %.1f)' %
+                              (name, 1000.0*histogram.last,
+                               1000.0*histogram.get_percentile(0.9))
+                              for name, histogram in self.histograms.items())
+
+    def save_report(self, filename):
+        """Write per-stage latency statistics to a JSON file"""
+        with self.lock:
+            report = OrderedDict((name, histogram.get_report())
+                                 for name, histogram in
+                                 self.histograms.items())
+        with open(filename, 'w') as filehandle:
+            json.dump(report, filehandle, indent=2)
+
+def profiled(stage):
+    """Decorator that times an Application method as the named stage"""
+    def decorate(method):
+        """Returns method wrapped in a timer"""
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            """Calls method, timed"""
+            with self.profiler.stage(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+###############################################################################
 
 class Application(Frame):
     """Container class, encapsulates app"""
     # this class inherits from Tkinter.parent
-    def __init__(self, path, master=None):
+    def __init__(self, path, master=None, num_prefetch=NUM_PREFETCH,
+                 cache_megabytes=CACHE_MEGABYTES,
+                 decode_megabytes=DECODE_MEGABYTES, store=None,
+                 profiler=None, propagate=False,
+                 disk_cache_megabytes=DISK_CACHE_MEGABYTES):
         """Constructor"""
         # call parent class constructor
         Frame.__init__(self, master)
 
+        # times select, resize, redraw, click and save, if enabled
+        self.profiler = profiler if profiler is not None else \
+            LatencyProfiler(enabled=False)
+
         self.path = path
-        self.image_filenames = find_image_files(path)
+
+        # image filenames, in the order found by the background scan until
+        # it completes, then sorted
+        self.image_filenames = []
+
+        # record of the dataset's files, loaded and updated by the
+        # background scan
+        self.manifest = ImageManifest(path)
+
+        # batches of (image filenames, labeled flags) found by the
+        # background scan, None once it is done
+        self.scan_queue = queue.Queue()
+
+        # whether the background scan is still running
+        self.scanning = False
+
+        # hands out disjoint batches of images to annotators working on
+        # this dataset at the same time
+        self.claims = ClaimQueue(path)
+
+        # indices of unlabeled images claimed for this annotator, in order
+        self.claimed = []
+
+        # index of the first image not yet considered for claiming
+        self.claim_cursor = 0
+
+        # time of this annotator's last select or click - claims are no
+        # longer renewed once they have been idle for CLAIM_TIMEOUT
+        self.last_activity = time.time()
+
+        # index of the image that navigation keys moved to, not yet shown,
+        # or None
+        self.navigate_target = None
+
+        # pending call of finish_navigation(), or None
+        self.navigate_job = None
+
+        # time when the last navigation key was handled
+        self.last_navigate = 0.0
+
+        # where points are read from and saved to, .pts files by default -
+        # saving is done in the background
+        self.store = WriteBehindStore(store if store is not None else
+                                      PtsFileStore(self.manifest),
+                                      profiler=self.profiler)
+
+        # decodes and scales images, those next to the current selection
+        # are prepared in the background
+        self.prefetcher = ImagePrefetcher(
+            ImageCache(cache_megabytes*1024*1024),
+            max_decode_bytes=decode_megabytes*1024*1024,
+            disk_cache=DiskCache(get_cache_dirname(),
+                                 disk_cache_megabytes*1024*1024)
+            if disk_cache_megabytes > 0 else None)
+
+        # number of images before and after current selection to prefetch
+        self.num_prefetch = num_prefetch
+
+        # if propagating, predicts the points of each unlabeled image from
+        # those of the image shown before it
+        self.propagator = PointPropagator(decode_megabytes*1024*1024,
+                                          self.profiler) \
+            if propagate else None
+
+        # (image filename, future of its predicted points) being predicted
+        self.prediction = None
+
+        # (N, 2) array of predicted coords of current selection's pts, or
+        # None
+        self.points_predicted = None
+
+        # canvas line items of predicted points' crosshairs, two per point
+        self.predicted_items = []
 
         # necessary to make the application actually appear on the screen
         self.grid(sticky=N+S+E+W)
 
-        # PIL image, for loading from file and for resizing
-        self.image_pil = None
+        # (width, height) of current selection's image, in pixels
+        self.image_size = None
+
+        # (image filename, image scaled to fit the canvas) last shown whole,
+        # which previews are scaled from
+        self.image_whole = None
+
+        # pending call of finish_render(), or None
+        self.render_job = None
 
         # Tk photoimage, for display
         self.image_tk = None
 
-        # list of coords (2-element lists) of current selection's pts
-        self.points_orig = []
+        # (image filename, canvas width, canvas height) that image_tk was
+        # made for - while these stay the same, image_tk is reused
+        self.image_tk_key = None
+
+        # (N, 2) array of coords of current selection's pts
+        self.points_orig = points_to_array([])
 
         # points_canvas is 'points_orig', in canvas coordinates
-        self.points_canvas = []
+        self.points_canvas = points_to_array([])
+
+        # canvas line items of each point's crosshair, in the same order as
+        # the points - each is [vertical line, horizontal line, color]
+        self.crosshairs = []
+
+        # crosshairs not in use, hidden, kept for reuse
+        self.crosshair_pool = []
+
+        # canvas item that shows image_tk
+        self.image_item = None
+
+        # canvas coords (left, top, right, bottom) of image_tk
+        self.image_box = None
+
+        # magnification relative to the whole image fitting the canvas -
+        # above 1, only the part of the image in view is scaled and shown
+        self.zoom = 1.0
+
+        # image coords shown at the canvas's top-left corner, when zoomed
+        self.view_origin = (0.0, 0.0)
+
+        # current selection's image at several resolutions, made when it is
+        # first zoomed into
+        self.pyramid = None
+
+        # (x, y, view_origin) where the current pan started
+        self.pan_start = None
 
         # x- and y-coords of displayed image in canvas coordinate frame
         self.x_offset = -1
@@ -80,7 +497,7 @@ class Application(Frame):
         top = self.winfo_toplevel()
 
         # set the title of the top level window
-        top.title('Image Point Tagging Tool')
+        self.set_title()
 
         # make row 0 of the top level window's grid stretchable
         top.rowconfigure(0, weight=1)
@@ -91,6 +508,13 @@ class Application(Frame):
         # bind keys for entire app
         top.bind_all('<Up>', self.select_prev)
         top.bind_all('<Down>', self.select_next)
+        top.bind_all('<Return>', self.select_claimed)
+        top.bind_all('<Key-a>', self.accept_predicted)
+        for key in ('<plus>', '<equal>', '<KP_Add>'):
+            top.bind_all(key, self.zoom_in)
+        for key in ('<minus>', '<KP_Subtract>'):
+            top.bind_all(key, self.zoom_out)
+        top.bind_all('<Key-0>', self.zoom_fit)
 
         # make row 0 of Application's widget's grid stretchable
         self.rowconfigure(0, weight=1)
@@ -105,12 +529,20 @@ class Application(Frame):
 
         # bind resize events (need -4 here bec. event gives 4+(real_size))
         self.canvas.bind('<Configure>', lambda e, s=self:
-                         s.on_resize_canvas(e.width-2, e.height-2))
+                         s.on_configure_canvas(e.width-2, e.height-2))
 
         # bind canvas mouse clicks
         self.canvas.bind('<Button-1>', self.on_click_button1)
         self.canvas.bind('<Button-3>', self.on_click_button3)
 
+        # bind canvas zooming and panning
+        self.canvas.bind('<Button-4>', lambda e, s=self:
+                         s.zoom_at(ZOOM_STEP, e.x, e.y))
+        self.canvas.bind('<Button-5>', lambda e, s=self:
+                         s.zoom_at(1.0/ZOOM_STEP, e.x, e.y))
+        self.canvas.bind('<Button-2>', self.on_click_button2)
+        self.canvas.bind('<B2-Motion>', self.on_drag_button2)
+
         # create scrollbars
         self.scrollbar_x = Scrollbar(self, orient=HORIZONTAL, width=10)
         self.scrollbar_y = Scrollbar(self, orient=VERTICAL, width=10)
@@ -118,6 +550,12 @@ class Application(Frame):
         self.scrollbar_x.grid(row=1, column=1, columnspan=2, sticky=E+W)
         self.scrollbar_y.grid(row=0, column=3, sticky=N+S)
 
+        # when profiling, show latencies in a status line below everything
+        if self.profiler.enabled:
+            self.label_status = Label(self, anchor=W, font=self.font)
+            self.label_status.grid(row=2, column=0, columnspan=4, sticky=E+W)
+            self.update_status()
+
         # create lb for showing labeled/not-labeled images
         self.listbox_marks = Listbox(self, width=1, takefocus=0,
                                      exportselection=0,
@@ -128,88 +566,252 @@ class Application(Frame):
         # create lb for showing image filenames
         self.lisbox_filenames = Listbox(self, width=30, selectmode=SINGLE,
                                         xscrollcommand=self.scrollbar_x.set,
-                                        yscrollcommand=self.scrollbar_y.set,
                                         exportselection=0, font=self.font)
         self.lisbox_filenames.grid(row=0, column=2, sticky=N+S+E+W)
 
+        # skip is # of chars to skip in path string so that only the
+        # part of the path that was not supplied is displayed
+        skip = len(self.path)
+        if self.path[skip-1] != '/':
+            skip += 1
+        self.skip = skip
+
+        # one byte per image, non-zero if image has a pts file
+        self.labeled = bytearray()
+
+        # the listboxes only ever hold the rows that are visible
+        self.file_list = VirtualList([self.listbox_marks,
+                                      self.lisbox_filenames],
+                                     self.scrollbar_y, self.get_list_row,
+                                     0, self.font)
+
         # bind scrollbar movement
         self.scrollbar_x['command'] = self.lisbox_filenames.xview
         self.scrollbar_y['command'] = self.on_scrollbar_y
 
         # bind left mouse click selection
         self.lisbox_filenames.bind('<Button-1>', lambda e, s=self:
-                                   s.select(self.lisbox_filenames.nearest(e.y)))
+                                   s.select(s.file_list.nearest(e.y)))
         self.listbox_marks.bind('<Button-1>', lambda e, s=self:
-                                s.select(self.lisbox_filenames.nearest(e.y)))
+                                s.select(s.file_list.nearest(e.y)))
 
         # bind wheel scroll
-        self.lisbox_filenames.bind('<Button-4>', lambda e, s=self:
-                                   on_mousewheel(self.listbox_marks, 4))
-        self.lisbox_filenames.bind('<Button-5>', lambda e, s=self:
-                                   on_mousewheel(self.listbox_marks, 5))
-        self.listbox_marks.bind('<Button-4>', lambda e, s=self:
-                                on_mousewheel(self.lisbox_filenames, 4))
-        self.listbox_marks.bind('<Button-5>', lambda e, s=self:
-                                on_mousewheel(self.lisbox_filenames, 5))
+        for listbox in (self.lisbox_filenames, self.listbox_marks):
+            listbox.bind('<Button-4>', lambda e, s=self:
+                         on_mousewheel(s.file_list, 4))
+            listbox.bind('<Button-5>', lambda e, s=self:
+                         on_mousewheel(s.file_list, 5))
+
+        # images are listed, and the first one that does not have a pts
+        # file (and is not claimed by another annotator) is selected, as
+        # the scan finds them
+        self.start_scan()
+
+        # keep claims and marks up to date
+        self.after(REFRESH_INTERVAL, self.refresh_claims)
+
+    def set_title(self, note=None):
+        """Set title of the top level window, with scan progress and note"""
+        title = 'Image Point Tagging Tool'
+        if self.scanning:
+            title += ' - scanning (%d images found)' % \
+                len(self.image_filenames)
+        if note is not None:
+            title += ' - %s' % note
+        self.winfo_toplevel().title(title)
+
+    def start_scan(self):
+        """Find images in the background, adding them to the list"""
+        self.scanning = True
+        thread = threading.Thread(target=self.run_scan)
+        thread.daemon = True
+        thread.start()
+        self.after(SCAN_POLL_INTERVAL, self.poll_scan)
+
+    def run_scan(self):
+        """Scan thread: queue each directory's images as they are found"""
+        try:
+            # a large manifest takes a while to parse, keep that off the
+            # Tk thread too
+            self.manifest.load()
+            for image_filenames in self.manifest.iter_scan():
+                labeled = self.store.find_labeled(image_filenames)
+                self.scan_queue.put((image_filenames, bytearray(
+                    image_filename in labeled
+                    for image_filename in image_filenames)))
+            self.manifest.save()
+        finally:
+            self.scan_queue.put(None)
+
+    def poll_scan(self):
+        """Add images found by the scan to the list, again and again"""
+        done = False
+        num_found = len(self.image_filenames)
+        while not done:
+            try:
+                batch = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                done = True
+            else:
+                self.image_filenames.extend(batch[0])
+                self.labeled.extend(batch[1])
+        if len(self.image_filenames) > num_found:
+            self.file_list.set_count(len(self.image_filenames))
+            # select first image found that does not have pts file
+            if self.get_selected_index() < 0:
+                self.select_claimed()
+        if done:
+            self.finish_scan()
+        else:
+            self.set_title()
+            self.after(SCAN_POLL_INTERVAL, self.poll_scan)
+
+    def finish_scan(self):
+        """Sort the list once the scan is done, keeping the selection"""
+        order = sorted(range(len(self.image_filenames)),
+                       key=self.image_filenames.__getitem__)
+        # new index of each image, by old index
+        new_index = numpy.empty(len(order), dtype=numpy.int64)
+        new_index[order] = numpy.arange(len(order))
+        selected = self.get_selected_index()
+        self.image_filenames = [self.image_filenames[i] for i in order]
+        self.labeled = bytearray(self.labeled[i] for i in order)
+        self.claimed = [int(new_index[i]) for i in self.claimed]
+        self.claim_cursor = 0
+        if self.navigate_target is not None:
+            self.navigate_target = int(new_index[self.navigate_target])
+            self.file_list.cursor = self.navigate_target
+        self.scanning = False
+        if selected >= 0:
+            # the same image stays shown, only its row moves
+            self.file_list.select(int(new_index[selected]))
+        elif not self.select_claimed() and self.image_filenames:
+            # every image has a pts file, or is claimed
+            self.select(0)
+        else:
+            self.file_list.refresh()
+        self.set_title()
 
-        # skip is # of chars to skip in path string so that only the
-        # part of the path that was not supplied is displayed
-        skip = len(self.path)
-        if self.path[skip-1] != '/':
-            skip += 1
+    def select_claimed(self, *args):
+        #pylint: disable=unused-argument
+        """Select the next unlabeled image claimed for this annotator,
+        claiming a batch of images if all claimed ones are labeled - returns
+        whether there was one"""
+        self.claimed = [i for i in self.claimed if not self.labeled[i]]
+        if not self.claimed:
+            self.claim_batch()
+        if not self.claimed and self.claim_cursor > 0 and not self.scanning:
+            # look again at images skipped, claims may have lapsed since
+            self.claim_cursor = 0
+            self.claim_batch()
+        # the next one after the selection, or else the first one
+        current = self.get_selected_index()
+        for i in sorted(self.claimed, key=lambda j: (j <= current, j)):
+            # claims may have lapsed (and been taken) while idle
+            if self.claims.claim(self.image_filenames[i]) == self.claims.owner:
+                self.select(i)
+                return True
+            self.claimed.remove(i)
+        return False
 
-        # insert image filenames plus marks into lists and
-        # select first image that does not have pts file
-        i = 0
-        index_of_image_with_no_pts_file = -1
-        for image_filename in self.image_filenames:
-            self.lisbox_filenames.insert(END, image_filename[skip:])
-            if self.has_pts_file(i):
-                self.listbox_marks.insert(END, '+')
-            else:
-                self.listbox_marks.insert(END, '')
-                if index_of_image_with_no_pts_file < 0:
-                    index_of_image_with_no_pts_file = i
-            i += 1
+    def claim_batch(self):
+        """Claim unlabeled images that no other annotator has claimed"""
+        i = self.labeled.find(0, self.claim_cursor)
+        while i >= 0 and len(self.claimed) < CLAIM_BATCH_SIZE:
+            image_filename = self.image_filenames[i]
+            if i not in self.claimed and \
+               self.claims.claim(image_filename) == self.claims.owner:
+                # it may have been labeled since it was listed
+                if self.store.has_points(image_filename):
+                    self.claims.release(image_filename)
+                    self.labeled[i] = 1
+                    self.file_list.refresh_row(i)
+                else:
+                    self.claimed.append(i)
+            self.claim_cursor = i+1
+            i = self.labeled.find(0, self.claim_cursor)
+
+    def can_edit(self):
+        """Returns whether selection is claimed for this annotator, claiming
+        it if no one else has, otherwise says who has"""
+        self.last_activity = time.time()
+        owner = self.claims.claim(self.get_image_filename())
+        if owner != self.claims.owner:
+            self.set_title('read only, %s is working on this image' % owner)
+            return False
+        return True
 
-        if index_of_image_with_no_pts_file < 0:
-            self.select(0)
+    def refresh_claims(self):
+        """Renew this annotator's claims unless idle, and show which visible
+        images others have labeled or claimed, again and again"""
+        i = self.get_selected_index()
+        if time.time()-self.last_activity < CLAIM_TIMEOUT:
+            claimed = [self.image_filenames[j] for j in self.claimed]
+            if i >= 0:
+                claimed.append(self.image_filenames[i])
+            self.claims.keep(claimed)
+        self.claims.find_others()
+        for j in self.file_list.get_visible():
+            self.labeled[j] = self.store.has_points(self.image_filenames[j])
+        self.file_list.refresh()
+        self.after(REFRESH_INTERVAL, self.refresh_claims)
+
+    def get_list_row(self, i):
+        """Returns (mark, filename) shown in the i'th row of the file list"""
+        # '+' if labeled, '*' if another annotator is working on it
+        if self.labeled[i]:
+            mark = '+'
+        elif self.claims.is_claimed_by_other(self.image_filenames[i]):
+            mark = '*'
         else:
-            self.select(index_of_image_with_no_pts_file)
+            mark = ''
+        return mark, self.image_filenames[i][self.skip:]
 
     def on_scrollbar_y(self, *args):
         """Vertical scrollbar motion callback"""
-        apply(self.lisbox_filenames.yview, args)
-        apply(self.listbox_marks.yview, args)
+        self.file_list.yview(*args)
 
+    @profiled('click')
     def on_click_button1(self, event):
         """Button 1 click callback: adds a crosshair at click location"""
-        if self.coord_in_img(event.x, event.y):
-            point = [(event.x-self.x_offset)/self.image_scaling,
-                     (event.y-self.y_offset)/self.image_scaling]
+        if self.coord_in_img(event.x, event.y) and self.can_edit():
             point_scaled = [float(event.x), float(event.y)]
-            self.points_orig.append(point)
-            self.points_canvas.append(point_scaled)
+            point = inverse_transform_points(points_to_array([point_scaled]),
+                                             self.image_scaling,
+                                             self.x_offset, self.y_offset)
+            self.points_orig = numpy.vstack([self.points_orig, point])
+            self.points_canvas = numpy.vstack([self.points_canvas,
+                                               point_scaled])
             if len(self.points_orig) == 1:
                 self.mark_labeled()
-            self.on_resize_canvas(int(self.canvas['width']),
-                                  int(self.canvas['height']))
+                # clicking points instead of accepting predicted ones
+                self.clear_predicted()
+            # the displayed image is unchanged, only the new point is drawn
+            self.place_crosshair(len(self.points_canvas)-1)
             self.save_points()
 
+    @profiled('click')
     def on_click_button3(self, event):
         """Button 3 click callback: deletes landmark near click location"""
-        if not self.coord_in_img(event.x, event.y):
+        if not self.coord_in_img(event.x, event.y) or not self.can_edit():
             return
         i = self.find_point_near_crosshair(event.x, event.y)
         if i >= 0:
-            del self.points_orig[i]
-            del self.points_canvas[i]
+            self.points_orig = numpy.delete(self.points_orig, i, axis=0)
+            self.points_canvas = numpy.delete(self.points_canvas, i, axis=0)
             if len(self.points_orig) == 0:
                 self.mark_unlabeled()
-            self.on_resize_canvas(int(self.canvas['width']),
-                                  int(self.canvas['height']))
+            # the displayed image is unchanged, only the point's crosshair
+            # goes (and crosshairs that move up into 1st or 2nd place change
+            # color)
+            self.release_crosshair(i)
+            for j in range(i, min(2, len(self.points_canvas))):
+                self.place_crosshair(j)
             self.save_points()
 
+    @profiled('select')
     def select(self, i):
         """Select the i'th image to work with - make current selection = i"""
         # uncomment the following line if you are only dealing with
@@ -217,163 +819,483 @@ class Application(Frame):
         # automatically reorder a previously tagged database so that
         # the person's right eye is the first point, left eye is
         # second point and mouth is third point
+        self.cancel_navigation()
         self.sort_points()
-        self.lisbox_filenames.selection_clear(0, END)
-        self.listbox_marks.selection_clear(0, END)
-        self.lisbox_filenames.selection_set(i)
-        self.listbox_marks.selection_set(i)
-        self.lisbox_filenames.see(i)
-        self.listbox_marks.see(i)
-        self.image_pil = PIL.Image.open(self.get_image_filename())
-        self.points_orig = self.read_pts_file()
+        # points of the image being left, to predict the next one's from
+        previous = None
+        if self.get_selected_index() >= 0 and len(self.points_orig) > 0:
+            previous = (self.get_image_filename(), self.points_orig)
+        # moving on from this image, so don't hold back its points
+        self.store.flush(wait=False)
+        self.last_activity = time.time()
+        if not self.scanning:
+            self.set_title()
+        self.file_list.select(i)
+        # each image is first shown whole
+        self.zoom = 1.0
+        self.pyramid = None
+        self.points_orig = points_to_array(self.read_pts_file())
+        self.clear_predicted()
+        if self.propagator is not None and previous is not None and \
+           len(self.points_orig) == 0:
+            self.prediction = (self.get_image_filename(),
+                               self.propagator.predict(
+                                   previous[0], previous[1],
+                                   self.get_image_filename()))
+            self.after(PREDICT_POLL_INTERVAL, self.poll_prediction)
         self.on_resize_canvas(int(self.canvas['width']),
                               int(self.canvas['height']))
 
     def select_prev(self, *args):
         #pylint: disable=unused-argument
         """Select entry that comes before current selection"""
-        i = self.get_selected_index()
+        i = self.get_navigation_index()
         if i > 0:
-            self.select(i-1)
+            self.navigate(i-1)
 
     def select_next(self, *args):
         #pylint: disable=unused-argument
         """Select entry that comes after current selection"""
-        i = self.get_selected_index()
+        i = self.get_navigation_index()
         if i < len(self.image_filenames)-1:
-            self.select(i+1)
+            self.navigate(i+1)
+
+    def get_navigation_index(self):
+        """Returns index that navigation keys move on from"""
+        if self.navigate_target is not None:
+            return self.navigate_target
+        return self.get_selected_index()
+
+    def navigate(self, i):
+        """Select i'th image in response to a navigation key - right away
+        if keys were at rest, otherwise once they are"""
+        if time.time()-self.last_navigate > 0.001*NAVIGATE_DELAY and \
+           self.navigate_job is None:
+            self.select(i)
+            # a slow select must not make the next key look like a new press
+            self.last_navigate = time.time()
+            return
+        self.last_navigate = time.time()
+        self.navigate_target = i
+        # the row is shown at once, the image once keys rest
+        self.file_list.move_cursor(i)
+        # start loading it now, dropping loads of images skipped past that
+        # have not started yet
+        self.prefetcher.prefetch([self.image_filenames[i]],
+                                 (int(self.canvas['width']),
+                                  int(self.canvas['height'])))
+        if self.navigate_job is not None:
+            self.after_cancel(self.navigate_job)
+        self.navigate_job = self.after(NAVIGATE_DELAY, self.finish_navigation)
+
+    def finish_navigation(self):
+        """Show the image that navigation keys stopped on"""
+        self.navigate_job = None
+        if self.navigate_target is not None:
+            self.select(self.navigate_target)
+        self.last_navigate = time.time()
+
+    def cancel_navigation(self):
+        """Forget about any image that navigation keys moved to"""
+        if self.navigate_job is not None:
+            self.after_cancel(self.navigate_job)
+            self.navigate_job = None
+        self.navigate_target = None
+
+    def poll_prediction(self):
+        """Show predicted points once they are ready"""
+        if self.prediction is None:
+            return
+        image_filename, future = self.prediction
+        if not future.done():
+            self.after(PREDICT_POLL_INTERVAL, self.poll_prediction)
+            return
+        self.prediction = None
+        if image_filename != self.get_image_filename() or \
+           len(self.points_orig) > 0:
+            return
+        try:
+            self.points_predicted = future.result()
+        except (IOError, ValueError) as error:
+            print('\tWarning: cannot predict points of %s: %s' %
+                  (image_filename, error))
+            return
+        self.redraw_predicted()
+
+    def clear_predicted(self):
+        """Forget predicted points, and any prediction in progress"""
+        if self.prediction is not None:
+            self.prediction[1].cancel()
+            self.prediction = None
+        if self.points_predicted is not None:
+            self.points_predicted = None
+            self.redraw_predicted()
+
+    def accept_predicted(self, *args):
+        #pylint: disable=unused-argument
+        """Make the predicted points the selection's points"""
+        if self.points_predicted is None or len(self.points_orig) > 0 or \
+           not self.can_edit():
+            return
+        self.points_orig = self.points_predicted
+        self.clear_predicted()
+        self.points_canvas = transform_points(self.points_orig,
+                                              self.image_scaling,
+                                              self.x_offset, self.y_offset)
+        self.redraw_points()
+        self.mark_labeled()
+        self.save_points()
 
-    def on_resize_canvas(self, width, height):
-        """Called when canvas is resized"""
-        if width <= 0 or height <= 0:
+    def on_click_button2(self, event):
+        """Button 2 click callback: starts panning a zoomed image"""
+        self.pan_start = (event.x, event.y, self.view_origin)
+
+    def on_drag_button2(self, event):
+        """Button 2 motion callback: pans a zoomed image with the mouse"""
+        if self.zoom <= 1.0 or self.pan_start is None:
+            return
+        x_start, y_start, origin = self.pan_start
+        self.view_origin = (origin[0]-(event.x-x_start)/self.image_scaling,
+                            origin[1]-(event.y-y_start)/self.image_scaling)
+        self.on_resize_canvas(int(self.canvas['width']),
+                              int(self.canvas['height']), preview=True)
+        self.schedule_render()
+
+    def zoom_at(self, factor, x_coord, y_coord):
+        """Magnify by factor, keeping what is at (x_coord, y_coord) there"""
+        if self.image_tk is None:
             return
-        # maximize image width or height depending on aspect ratios
-        image_width = self.image_pil.size[0]
-        image_height = self.image_pil.size[1]
-        image_aspect_ratio = float(image_width)/float(image_height)
+        zoom = min(max(self.zoom*factor, 1.0), MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+        # image coords of the point that stays in place
+        point_x = (x_coord-self.x_offset)/self.image_scaling
+        point_y = (y_coord-self.y_offset)/self.image_scaling
+        self.zoom = zoom
+        canvas_size = (int(self.canvas['width']), int(self.canvas['height']))
+        scaling = self.get_zoomed_scaling(canvas_size)
+        self.view_origin = (point_x-x_coord/scaling, point_y-y_coord/scaling)
+        self.on_resize_canvas(*canvas_size, preview=True)
+        self.schedule_render()
+
+    def zoom_in(self, *args):
+        #pylint: disable=unused-argument
+        """Magnify by one step, around the canvas's center"""
+        self.zoom_at(ZOOM_STEP, 0.5*int(self.canvas['width']),
+                     0.5*int(self.canvas['height']))
+
+    def zoom_out(self, *args):
+        #pylint: disable=unused-argument
+        """Shrink by one step, around the canvas's center"""
+        self.zoom_at(1.0/ZOOM_STEP, 0.5*int(self.canvas['width']),
+                     0.5*int(self.canvas['height']))
+
+    def zoom_fit(self, *args):
+        #pylint: disable=unused-argument
+        """Show the whole image again"""
+        self.zoom_at(1.0/MAX_ZOOM, 0.0, 0.0)
+
+    def get_zoomed_scaling(self, canvas_size):
+        """Returns scaling of the image, at the current zoom, in canvas"""
+        fit_size = fit_image_size(self.image_size, canvas_size)
+        return self.zoom*get_display_geometry(self.image_size, fit_size,
+                                              canvas_size)[2]
+
+    def on_configure_canvas(self, width, height):
+        """Canvas resize callback: previews the image at the new size at
+        once, and renders it at full quality once the size settles"""
+        self.on_resize_canvas(width, height, preview=True)
+        self.schedule_render()
+
+    def schedule_render(self):
+        """Render the image at full quality once the canvas, zoom and pan
+        have not changed for RENDER_DELAY"""
+        if self.render_job is not None:
+            self.after_cancel(self.render_job)
+        self.render_job = self.after(RENDER_DELAY, self.finish_render)
+
+    def finish_render(self):
+        """Replace a preview with the image rendered at full quality"""
+        self.render_job = None
+        self.on_resize_canvas(int(self.canvas['width']),
+                              int(self.canvas['height']))
 
+    @profiled('resize')
+    def on_resize_canvas(self, width, height, preview=False):
+        """Called when canvas is resized - if preview, the image may be
+        scaled quickly at low quality"""
+        if width <= 0 or height <= 0:
+            return
         self.canvas['width'] = width
         self.canvas['height'] = height
         canvas_width = int(self.canvas['width'])
         canvas_height = int(self.canvas['height'])
-        canvas_aspect_ratio = float(canvas_width)/float(canvas_height)
 
-        if image_aspect_ratio < canvas_aspect_ratio:
-            new_image_width = int(image_aspect_ratio*float(canvas_height))
-            new_image_height = canvas_height
-        else:
-            new_image_width = canvas_width
-            new_image_height = int(float(canvas_width)/image_aspect_ratio)
-
-        self.image_tk = PhotoImage(self.image_pil.resize((new_image_width,
-                                                          new_image_height),
-                                                         PIL.Image.BILINEAR))
+        # nothing to show until the scan finds an image
+        if self.get_selected_index() < 0:
+            return
 
-        self.x_offset = 0.5*(float(canvas_width)-float(new_image_width))
-        self.y_offset = 0.5*(float(canvas_height)-float(new_image_height))
+        if self.zoom > 1.0:
+            # keep as much of the canvas covered as the zoomed image can
+            self.view_origin = clamp_view_origin(
+                self.image_size, (canvas_width, canvas_height),
+                self.get_zoomed_scaling((canvas_width, canvas_height)),
+                self.view_origin)
+
+        # only rescale and redisplay the image if it, the canvas or the
+        # view changed
+        image_tk_key = (self.get_image_filename(), canvas_width, canvas_height,
+                        self.zoom, self.view_origin)
+        preview_key = image_tk_key+('preview',)
+        if self.image_tk_key != image_tk_key and \
+           not (preview and self.image_tk_key == preview_key):
+            if self.display_image(canvas_width, canvas_height, preview):
+                self.image_tk_key = preview_key
+            else:
+                self.image_tk_key = image_tk_key
 
-        self.crosshair_radius = 0.5*self.crosshair_fraction*float(
-            min(new_image_width, new_image_height))
-
-        self.canvas.delete('image')
-        self.canvas.create_image(self.x_offset, self.y_offset, anchor=NW,
-                                 image=self.image_tk, tags='image')
-
-        width_scale = float(new_image_width)/float(image_width)
-        height_scale = float(new_image_height)/float(image_height)
-        self.image_scaling = 0.5*(width_scale+height_scale)
-        self.points_canvas = [[x[0]*self.image_scaling+self.x_offset,
-                               x[1]*self.image_scaling+self.y_offset]
-                              for x in self.points_orig]
+        self.points_canvas = transform_points(self.points_orig,
+                                              self.image_scaling,
+                                              self.x_offset, self.y_offset)
         self.redraw_points()
+        self.redraw_predicted()
+
+        # get the neighbours ready at this canvas size while the user works
+        # - not at the passing sizes of a window being resized
+        if not preview:
+            self.prefetcher.prefetch(self.get_neighbour_filenames(),
+                                     (canvas_width, canvas_height))
+
+    def display_image(self, canvas_width, canvas_height, preview=False):
+        """Show selected image scaled to fit the canvas, centered, or the
+        part of it that is in view when zoomed - returns whether a preview
+        was shown instead"""
+        canvas_size = (canvas_width, canvas_height)
+        rendered = self.render_preview(canvas_size) if preview else None
+        if rendered is not None:
+            image_scaled, position = rendered
+        elif self.zoom > 1.0:
+            image_scaled, position = self.render_view(canvas_size)
+        else:
+            # image scaled to fit canvas, from the cache if it was prefetched
+            with self.profiler.stage('decode'):
+                image_scaled, self.image_size = self.prefetcher.load(
+                    self.get_image_filename(), canvas_size)
+            self.image_whole = (self.get_image_filename(), image_scaled)
+            self.x_offset, self.y_offset, self.image_scaling = \
+                get_display_geometry(self.image_size, image_scaled.size,
+                                     canvas_size)
+            position = (self.x_offset, self.y_offset)
+        new_image_width, new_image_height = image_scaled.size
+
+        self.image_tk = PhotoImage(image_scaled)
+        self.image_box = (position[0], position[1],
+                          position[0]+new_image_width,
+                          position[1]+new_image_height)
+
+        # crosshairs stay as big as when the whole image is shown
+        self.crosshair_radius = 0.5*self.crosshair_fraction*float(
+            min(fit_image_size(self.image_size, canvas_size)))
 
+        # reuse the image item, so that it stays below the crosshairs
+        if self.image_item is None:
+            self.image_item = self.canvas.create_image(
+                position[0], position[1], anchor=NW, image=self.image_tk,
+                tags='image')
+        else:
+            self.canvas.coords(self.image_item, *position)
+            self.canvas.itemconfig(self.image_item, image=self.image_tk)
+        return rendered is not None
+
+    def render_preview(self, canvas_size):
+        """Returns (image in view, quickly scaled from an image already
+        decoded, its position), or None if there is no such image"""
+        filename = self.get_image_filename()
+        zoomed = self.zoom > 1.0 and self.pyramid is not None and \
+            self.pyramid.filename == filename
+        if not zoomed and (self.image_whole is None or
+                           self.image_whole[0] != filename):
+            return None
+        self.image_scaling = self.get_zoomed_scaling(canvas_size)
+        # not zoomed, this centers the whole image
+        origin = clamp_view_origin(self.image_size, canvas_size,
+                                   self.image_scaling, self.view_origin)
+        self.x_offset = -origin[0]*self.image_scaling
+        self.y_offset = -origin[1]*self.image_scaling
+        box, display_size, position = get_viewport(
+            self.image_size, canvas_size, self.image_scaling, origin)
+        if zoomed:
+            return (self.pyramid.render(self.image_scaling, box, display_size,
+                                        PIL.Image.NEAREST), position)
+        image_whole = self.image_whole[1]
+        x_scale = float(image_whole.size[0])/float(self.image_size[0])
+        y_scale = float(image_whole.size[1])/float(self.image_size[1])
+        return (image_whole.resize(display_size, PIL.Image.NEAREST,
+                                   box=(box[0]*x_scale, box[1]*y_scale,
+                                        box[2]*x_scale, box[3]*y_scale)),
+                position)
+
+    def render_view(self, canvas_size):
+        """Returns (part of zoomed image that is in view, its position)"""
+        filename = self.get_image_filename()
+        if self.pyramid is None or self.pyramid.filename != filename:
+            with self.profiler.stage('decode'):
+                self.pyramid = ImagePyramid(filename,
+                                            self.prefetcher.max_decode_bytes)
+        self.image_scaling = self.get_zoomed_scaling(canvas_size)
+        self.x_offset = -self.view_origin[0]*self.image_scaling
+        self.y_offset = -self.view_origin[1]*self.image_scaling
+        # only the part in view is cropped and scaled
+        box, display_size, position = get_viewport(
+            self.image_size, canvas_size, self.image_scaling,
+            self.view_origin)
+        return (self.pyramid.render(self.image_scaling, box, display_size),
+                position)
+
+    def get_neighbour_filenames(self):
+        """Returns filenames of images near selection, nearest ones first"""
+        i = self.get_selected_index()
+        filenames = []
+        for distance in range(1, self.num_prefetch+1):
+            # the next image is the likeliest to be visited, then previous
+            for j in (i+distance, i-distance):
+                if 0 <= j < len(self.image_filenames):
+                    filenames.append(self.image_filenames[j])
+        return filenames
+
+    def update_status(self):
+        """Show latest latencies in the status line, again and again"""
+        self.label_status['text'] = self.profiler.get_status()
+        self.after(STATUS_INTERVAL, self.update_status)
+
+    def shutdown(self):
+        """Stop background work, called once the main loop has exited"""
+        self.prefetcher.shutdown()
+        if self.propagator is not None:
+            self.propagator.shutdown()
+        self.store.close()
+        self.claims.release_all()
+        FRAME_FILES.close()
+
+    @profiled('redraw')
     def redraw_points(self):
         """redraw points in current entry's .pts file"""
-        self.canvas.delete('line')
-
-        # draw first crosshair in color1
-        if len(self.points_canvas) > 0:
-            point1 = self.points_canvas[0]
-            self.draw_crosshair(point1[0], point1[1], self.crosshair1_color)
-
-        # draw second crosshair in color2
-        if len(self.points_canvas) > 1:
-            point2 = self.points_canvas[1]
-            self.draw_crosshair(point2[0], point2[1], self.crosshair2_color)
-
-        # draw third or higher crosshair in color3
-        if len(self.points_canvas) > 2:
-            for point in self.points_canvas[2:]:
-                self.draw_crosshair(point[0], point[1], self.crosshair3_color)
-
-    def draw_crosshair(self, x_coord, y_coord, fill_color):
-        """Draw a cross at (x_coord, y_coord) in the currently selected image"""
+        # crosshairs of points that are gone go back to the pool
+        while len(self.crosshairs) > len(self.points_canvas):
+            self.release_crosshair(len(self.crosshairs)-1)
+        for i in range(len(self.points_canvas)):
+            self.place_crosshair(i)
+
+    def redraw_predicted(self):
+        """Draw predicted points as dashed crosshairs, hide unused ones"""
+        if self.points_predicted is None or self.image_tk is None:
+            points = points_to_array([])
+        else:
+            points = transform_points(self.points_predicted,
+                                      self.image_scaling,
+                                      self.x_offset, self.y_offset)
+        while len(self.predicted_items) < 2*len(points):
+            self.predicted_items.append(self.canvas.create_line(
+                0, 0, 0, 0, width=self.crosshair_thickness, dash=(4, 4),
+                tags='predicted'))
+        for i, (x_coord, y_coord) in enumerate(points):
+            fill_color = self.get_crosshair_color(i)
+            for item, coords in zip(self.predicted_items[2*i:2*i+2],
+                                    self.get_crosshair_coords(x_coord,
+                                                              y_coord)):
+                self.canvas.coords(item, *coords)
+                self.canvas.itemconfig(item, state='normal', fill=fill_color)
+        for item in self.predicted_items[2*len(points):]:
+            self.canvas.itemconfig(item, state='hidden')
+
+    def get_crosshair_color(self, i):
+        """Returns color of i'th point's crosshair"""
+        # first crosshair in color1, second crosshair in color2, third or
+        # higher crosshair in color3
+        if i == 0:
+            return self.crosshair1_color
+        if i == 1:
+            return self.crosshair2_color
+        return self.crosshair3_color
+
+    def place_crosshair(self, i):
+        """Move i'th point's crosshair into place, drawing it if it's new"""
+        if i == len(self.crosshairs):
+            # take a crosshair from the pool, or make one
+            if self.crosshair_pool:
+                crosshair = self.crosshair_pool.pop()
+                for item in crosshair[:2]:
+                    self.canvas.itemconfig(item, state='normal')
+            else:
+                crosshair = [self.canvas.create_line(
+                    0, 0, 0, 0, width=self.crosshair_thickness, tags='line')
+                             for _ in range(2)]+[None]
+            self.crosshairs.append(crosshair)
+        crosshair = self.crosshairs[i]
+        vertical, horizontal = self.get_crosshair_coords(
+            self.points_canvas[i][0], self.points_canvas[i][1])
+        self.canvas.coords(crosshair[0], *vertical)
+        self.canvas.coords(crosshair[1], *horizontal)
+        fill_color = self.get_crosshair_color(i)
+        if crosshair[2] != fill_color:
+            self.canvas.itemconfig(crosshair[0], fill=fill_color)
+            self.canvas.itemconfig(crosshair[1], fill=fill_color)
+            crosshair[2] = fill_color
+
+    def release_crosshair(self, i):
+        """Hide i'th crosshair and return it to the pool"""
+        crosshair = self.crosshairs.pop(i)
+        for item in crosshair[:2]:
+            self.canvas.itemconfig(item, state='hidden')
+        self.crosshair_pool.append(crosshair)
+
+    def get_crosshair_coords(self, x_coord, y_coord):
+        """Returns coords of vertical and horizontal lines of a cross at
+        (x_coord, y_coord), clipped to the currently selected image"""
         start_x = x_coord-self.crosshair_radius
         start_y = y_coord-self.crosshair_radius
 
         end_x = x_coord+self.crosshair_radius
         end_y = y_coord+self.crosshair_radius
 
-        min_x = self.x_offset
-        min_y = self.y_offset
-
-        max_x = self.x_offset+self.image_tk.width()-1
-        max_y = self.y_offset+self.image_tk.height()-1
+        min_x, min_y, max_x, max_y = self.image_box
+        max_x -= 1
+        max_y -= 1
 
         if start_x < min_x:
             start_x = min_x
         if start_y < min_y:
             start_y = min_y
 
+        # crosshairs of points out of view shrink to nothing
         if end_x > max_x:
-            end_x = max_x
+            end_x = max(max_x, start_x)
         if end_y > max_y:
-            end_y = max_y
+            end_y = max(max_y, start_y)
 
-        self.canvas.create_line(x_coord, start_y, x_coord, end_y,
-                                width=self.crosshair_thickness, tags='line',
-                                fill=fill_color)
-        self.canvas.create_line(start_x, y_coord, end_x, y_coord,
-                                width=self.crosshair_thickness, tags='line',
-                                fill=fill_color)
+        return ((x_coord, start_y, x_coord, end_y),
+                (start_x, y_coord, end_x, y_coord))
 
     def get_selected_index(self):
         """Returns index of current selection"""
-        return int(self.lisbox_filenames.curselection()[0])
+        return self.file_list.selected
 
     def coord_in_img(self, x_coord, y_coord):
         """Returns whether (x_coord, y_coord) is inside the shown image"""
-        return (x_coord >= self.x_offset and
-                y_coord >= self.y_offset and
-                x_coord < self.x_offset+self.image_tk.width() and
-                y_coord < self.y_offset+self.image_tk.height())
+        if self.image_tk is None:
+            return False
+        min_x, min_y, max_x, max_y = self.image_box
+        return min_x <= x_coord < max_x and min_y <= y_coord < max_y
 
     def find_point_near_crosshair(self, x_coord, y_coord):
         """Returns index of landmark point near (x_coord, y_coord), or -1"""
-        i = 0
-        i_min = -1
-        min_dist = self.image_tk.width()+self.image_tk.height()
-        for pair in self.points_canvas:
-            x_dist = x_coord-pair[0]
-            y_dist = y_coord-pair[1]
-            dist = sqrt(x_dist*x_dist+y_dist*y_dist)
-            if dist <= self.crosshair_radius and dist < min_dist:
-                i_min = i
-            i += 1
-        return i_min
+        return find_nearest_point(self.points_canvas, x_coord, y_coord,
+                                  self.crosshair_radius)
 
     def save_points(self):
         """Save current points to pts file"""
-        # remove whatever was there before
-        if self.has_pts_file():
-            os.remove(self.get_pts_filename())
-        # save current result
-        if len(self.points_orig) > 0:
-            filehandle = open(self.get_pts_filename(), 'w')
-            for pair in self.points_orig:
-                message = str(pair[0])+', '+str(pair[1])+'\n'
-                filehandle.write(message)
-            filehandle.close()
+        self.store.write_points(self.get_image_filename(),
+                                self.points_orig.tolist())
 
     def sort_points(self):
         """
@@ -382,21 +1304,9 @@ class Application(Frame):
         left eye and the third point is the mouth.  NB: this function only
         (destructively) works on self.points_orig
         """
-        if len(self.points_orig) != 3:
-            return
-        # step 1 sort the points according to y-value
-        self.points_orig.sort(key=lambda pt: pt[1])
-        # step 2: from the top-most two points, call the leftmost one
-        # the person's right eye and call the other the person's left eye
-        if self.points_orig[0][0] > self.points_orig[1][0]:
-            # swap first and second points' x-coordinate
-            tmp = self.points_orig[0][0]
-            self.points_orig[0][0] = self.points_orig[1][0]
-            self.points_orig[1][0] = tmp
-            # swap first and second points' y-coordinate
-            tmp = self.points_orig[0][1]
-            self.points_orig[0][1] = self.points_orig[1][1]
-            self.points_orig[1][1] = tmp
+        points = self.points_orig.tolist()
+        if sort_face_points(points):
+            self.points_orig = points_to_array(points)
             # order changed, so re-save
             self.save_points()
 
@@ -404,14 +1314,13 @@ class Application(Frame):
         """Returns whether (i'th) selection has a pts file with landmarks"""
         if i is None:
             i = self.get_selected_index()
-        return os.path.exists(self.get_pts_filename(i))
+        return self.store.has_points(self.get_image_filename(i))
 
     def get_pts_filename(self, i=None):
         """Returns filename of selected (or i'th) .pts file"""
         if i is None:
             i = self.get_selected_index()
-        image_filename = self.image_filenames[i]
-        return os.path.splitext(image_filename)[0]+'.pts'
+        return get_pts_filename(self.image_filenames[i])
 
     def get_image_filename(self, i=None):
         """Returns filename of (i'th) selection's image"""
@@ -423,62 +1332,809 @@ class Application(Frame):
         """Returns list of points (lists) in (i'th) selection's .pts file"""
         if i is None:
             i = self.get_selected_index()
-        if self.has_pts_file(i):
-            filehandle = open(self.get_pts_filename(i), 'r')
-            lines = filehandle.readlines()
-            filehandle.close()
-            return [[float(pair[0]), float(pair[1])]
-                    for pair in [line.split(',') for line in lines]]
-        else:
-            return []
+        return self.store.read_points(self.get_image_filename(i))
 
     def mark_labeled(self, i=None):
         """Mark (i'th) selection as having a .pts file"""
         if i is None:
             i = self.get_selected_index()
-        self.listbox_marks.insert(i, '+')
-        self.listbox_marks.delete(i+1)
-        self.listbox_marks.selection_set(i)
+        self.labeled[i] = 1
+        self.file_list.refresh_row(i)
 
     def mark_unlabeled(self, i=None):
         """Unmark (i'th) selection as having a .pts file"""
         if i is None:
             i = self.get_selected_index()
-        self.listbox_marks.insert(i, '')
-        self.listbox_marks.delete(i+1)
-        self.listbox_marks.selection_set(i)
+        self.labeled[i] = 0
+        self.file_list.refresh_row(i)
 
 ###############################################################################
 
+def fit_image_size(image_size, canvas_size):
+    """Returns largest (width, height) with image's aspect that fits canvas"""
+    # maximize image width or height depending on aspect ratios
+    image_width, image_height = image_size
+    canvas_width, canvas_height = canvas_size
+    image_aspect_ratio = float(image_width)/float(image_height)
+    canvas_aspect_ratio = float(canvas_width)/float(canvas_height)
+
+    if image_aspect_ratio < canvas_aspect_ratio:
+        new_image_width = int(image_aspect_ratio*float(canvas_height))
+        new_image_height = canvas_height
+    else:
+        new_image_width = canvas_width
+        new_image_height = int(float(canvas_width)/image_aspect_ratio)
+    return new_image_width, new_image_height
+
+def get_reduction_factor(image_size, nbands, min_size, max_bytes):
+    """Returns power-of-two factor to shrink an image by while decoding it"""
+    width, height = image_size
+    # shrink as much as possible while still covering min_size...
+    factor = 1
+    while width//(2*factor) >= max(min_size[0], 1) and \
+          height//(2*factor) >= max(min_size[1], 1):
+        factor *= 2
+    # ...but more than that if decoded pixels would not fit in max_bytes
+    while width*height*nbands > max_bytes*factor*factor and \
+          width >= 2*factor and height >= 2*factor:
+        factor *= 2
+    return factor
+
+def seek_reduced_tiff_page(image, min_size, max_bytes):
+    """Seek a TIFF from its current page to the smallest reduced-resolution
+    version of that page that will do"""
+    nbands = len(image.getbands())
+    pages = [(image.tell(), image.size)]
+    while True:
+        try:
+            image.seek(pages[-1][0]+1)
+        except EOFError:
+            break
+        # bit 0 of NewSubfileType marks a reduced-resolution version of
+        # the page before it, as written by scanners and pyramid-TIFF tools
+        if not image.tag_v2.get(254, 0) & 1:
+            break
+        pages.append((image.tell(), image.size))
+
+    def area(page):
+        """Returns number of pixels in page"""
+        return page[1][0]*page[1][1]
+
+    fitting = [page for page in pages if area(page)*nbands <= max_bytes]
+    covering = [page for page in fitting if page[1][0] >= min_size[0] and
+                page[1][1] >= min_size[1]]
+    if covering:
+        image.seek(min(covering, key=area)[0])
+    elif fitting:
+        image.seek(max(fitting, key=area)[0])
+    else:
+        image.seek(min(pages, key=area)[0])
+
+def reduce_on_decode(image, min_size, max_bytes):
+    """Set up an opened image to be decoded at reduced resolution"""
+    # only some formats can decode at reduced resolution - the others are
+    # decoded in full, and shrunk afterwards
+    factor = get_reduction_factor(image.size, len(image.getbands()),
+                                  min_size, max_bytes)
+    if image.format == 'JPEG':
+        # draft mode makes the JPEG decoder skip DCT coefficients, it can
+        # shrink by up to 8 and picks the largest factor that keeps the
+        # requested size
+        if factor > 1:
+            image.draft(image.mode, (image.size[0]//factor,
+                                     image.size[1]//factor))
+    elif image.format == 'JPEG2000':
+        # the number of wavelet resolution levels to discard
+        image.reduce = factor.bit_length()-1
+    elif image.format == 'TIFF':
+        seek_reduced_tiff_page(image, min_size, max_bytes)
+
+def get_display_geometry(image_size, display_size, canvas_size):
+    """
+    Returns (x_offset, y_offset, scaling) of an image of original size
+    image_size, shown at display_size centered in a canvas of canvas_size
+    """
+    image_width, image_height = image_size
+    new_image_width, new_image_height = display_size
+    canvas_width, canvas_height = canvas_size
+
+    x_offset = 0.5*(float(canvas_width)-float(new_image_width))
+    y_offset = 0.5*(float(canvas_height)-float(new_image_height))
+
+    width_scale = float(new_image_width)/float(image_width)
+    height_scale = float(new_image_height)/float(image_height)
+    return x_offset, y_offset, 0.5*(width_scale+height_scale)
+
+def clamp_view_origin(image_size, canvas_size, scaling, origin):
+    """
+    Returns view origin (image coords shown at the canvas's top-left
+    corner) moved so that an image shown at scaling covers as much of the
+    canvas as it can - along axes where it is smaller, it is centered
+    """
+    clamped = []
+    for image_extent, canvas_extent, coord in zip(image_size, canvas_size,
+                                                  origin):
+        view_extent = float(canvas_extent)/scaling
+        if image_extent >= view_extent:
+            clamped.append(min(max(coord, 0.0), image_extent-view_extent))
+        else:
+            clamped.append(-0.5*(view_extent-image_extent))
+    return tuple(clamped)
+
+def get_viewport(image_size, canvas_size, scaling, origin):
+    """
+    Returns (box, display_size, position) of the part of an image that is
+    in view when shown at scaling with view origin at the canvas's top-left
+    corner: box is that part in image coords, display_size its size in the
+    canvas and position the canvas coords of its top-left corner
+    """
+    box = (max(0.0, origin[0]), max(0.0, origin[1]),
+           min(float(image_size[0]), origin[0]+canvas_size[0]/scaling),
+           min(float(image_size[1]), origin[1]+canvas_size[1]/scaling))
+    display_size = (max(1, int(round((box[2]-box[0])*scaling))),
+                    max(1, int(round((box[3]-box[1])*scaling))))
+    position = ((box[0]-origin[0])*scaling, (box[1]-origin[1])*scaling)
+    return box, display_size, position
+
+def get_frame_filename(filename, page):
+    """Returns name of the image that is page 'page' of a multi-frame file"""
+    return FRAME_FORMAT % (filename, page)
+
+def split_frame(image_filename):
+    """Returns (filename, page number) of a frame of a multi-frame file, or
+    (image_filename, None) if the image is a file of its own"""
+    match = FRAME_PATTERN.match(image_filename)
+    if match is None:
+        return image_filename, None
+    return match.group(1), int(match.group(2))
+
+def get_legacy_filename(image_filename):
+    """Returns name that the first frame of a multi-frame file was tagged
+    under, as a single image, before the file's frames were listed - or
+    None if image is not such a frame"""
+    filename, page = split_frame(image_filename)
+    return filename if page == 0 else None
+
+def get_decode_size(image_size, canvas_size):
+    """Returns smallest size to decode an image at, to show it in a canvas
+    of canvas_size - or in full, if canvas_size is None"""
+    if canvas_size is None:
+        return image_size
+    return fit_image_size(image_size, canvas_size)
+
+class FrameFile(object):
+    """A multi-frame image file kept open by FrameFiles"""
+    def __init__(self, filename, version):
+        """Constructor"""
+        self.filename = filename
+        # (mtime, size) of the file when opened
+        self.version = version
+        # held while the file is opened, seeked, decoded from or closed
+        self.lock = threading.Lock()
+        self.image = None
+        self.closed = False
+
+    def close(self):
+        """Close file, once no frame is being decoded from it"""
+        with self.lock:
+            self.closed = True
+            if self.image is not None:
+                self.image.close()
+                self.image = None
+
+class FrameFiles(object):
+    """
+    Thread-safe LRU set of open multi-frame image files.  An open file
+    keeps PIL's record of where each page seen so far starts - built
+    lazily, as pages are seeked to - so that seeking to those pages again
+    does not walk the file's pages.  Frames of a file are decoded one at a
+    time, frames of different files at the same time
+    """
+    def __init__(self, max_files=NUM_OPEN_FRAME_FILES):
+        """Constructor"""
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        # maps filename to its FrameFile, least recently used first
+        self.files = OrderedDict()
+
+    def get_file(self, filename, version):
+        """Returns FrameFile of filename, closing files that changed since
+        they were opened or that were least recently used"""
+        evicted = []
+        with self.lock:
+            frame_file = self.files.pop(filename, None)
+            if frame_file is not None and frame_file.version != version:
+                # the file changed, so did the position of its pages
+                evicted.append(frame_file)
+                frame_file = None
+            if frame_file is None:
+                frame_file = FrameFile(filename, version)
+            self.files[filename] = frame_file
+            while len(self.files) > self.max_files:
+                evicted.append(self.files.popitem(last=False)[1])
+        # closing waits for frames being decoded, not while holding the lock
+        for old_file in evicted:
+            old_file.close()
+        return frame_file
+
+    def load_frame(self, filename, page, canvas_size=None,
+                   max_decode_bytes=DECODE_MEGABYTES*1024*1024):
+        """Returns (page number 'page' of a multi-frame file, decoded at
+        reduced resolution where possible, its original size)"""
+        stat = os.stat(filename)
+        version = (stat.st_mtime_ns, stat.st_size)
+        while True:
+            frame_file = self.get_file(filename, version)
+            with frame_file.lock:
+                if frame_file.closed:
+                    # evicted by another thread since, open it again
+                    continue
+                if frame_file.image is None:
+                    frame_file.image = PIL.Image.open(filename)
+                image = frame_file.image
+                try:
+                    image.seek(page)
+                except EOFError as error:
+                    raise IOError('%s has no page %d' %
+                                  (filename, page)) from error
+                image_size = image.size
+                reduce_on_decode(image, get_decode_size(image_size,
+                                                        canvas_size),
+                                 max_decode_bytes)
+                # copy() decodes just the page seeked to, into an image of
+                # its own
+                return image.copy(), image_size
+
+    def close(self):
+        """Close all open files"""
+        with self.lock:
+            frame_files = list(self.files.values())
+            self.files.clear()
+        for frame_file in frame_files:
+            frame_file.close()
+
+# multi-frame files whose frames are being viewed, shared by all threads
+FRAME_FILES = FrameFiles()
+
+def open_image(image_filename, canvas_size=None,
+               max_decode_bytes=DECODE_MEGABYTES*1024*1024):
+    """Returns (image opened with PIL and set up to be decoded at reduced
+    resolution where possible, its original size) - a frame of a
+    multi-frame file is returned already decoded"""
+    filename, page = split_frame(image_filename)
+    if page is not None:
+        return FRAME_FILES.load_frame(filename, page, canvas_size,
+                                      max_decode_bytes)
+    image = PIL.Image.open(image_filename)
+    # the scaling is always relative to the original image size, no matter
+    # what resolution the image is actually decoded at
+    image_size = image.size
+    try:
+        reduce_on_decode(image, get_decode_size(image_size, canvas_size),
+                         max_decode_bytes)
+    except (IOError, EOFError):
+        image.close()
+        raise
+    return image, image_size
+
+def load_scaled_image(filename, canvas_size,
+                      max_decode_bytes=DECODE_MEGABYTES*1024*1024):
+    """Returns (image decoded and scaled to fit canvas, original size)"""
+    image, image_size = open_image(filename, canvas_size, max_decode_bytes)
+    with image:
+        # decode first, so that resize() sees the decoded size
+        image.load()
+        return image.resize(fit_image_size(image_size, canvas_size),
+                            PIL.Image.BILINEAR,
+                            reducing_gap=RESIZE_REDUCING_GAP), image_size
+
+def get_image_nbytes(image):
+    """Returns approximate number of bytes taken by a PIL image's pixels"""
+    return image.size[0]*image.size[1]*len(image.getbands())
+
+class ImageCache(object):
+    """Thread-safe LRU cache of scaled images, bounded by total pixel bytes"""
+    def __init__(self, max_bytes):
+        """Constructor"""
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # maps key to (value, nbytes), least recently used first
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Returns cached value for key, marking it as recently used, or
+        None"""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, nbytes):
+        """Add value to cache, evicting least recently used values"""
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+    def __contains__(self, key):
+        """Returns whether key is cached, without marking it as used"""
+        with self.lock:
+            return key in self.entries
+
+class ImagePyramid(object):
+    """
+    An image decoded once, plus halvings of it made as they are needed, so
+    that any part of it can be scaled to any size without decoding it again
+    or resizing more pixels than are shown
+    """
+    def __init__(self, filename, max_decode_bytes=DECODE_MEGABYTES*1024*1024):
+        """Constructor"""
+        self.filename = filename
+        image, self.image_size = open_image(filename, None, max_decode_bytes)
+        image.load()
+        # largest first, each half the size of the one before it
+        self.levels = [image]
+
+    def get_level(self, scaling):
+        """Returns smallest level with at least 'scaling' times the pixels
+        of the original image along each axis, or the largest level"""
+        min_width = scaling*self.image_size[0]
+        level = self.levels[-1]
+        while level.size[0] >= 2*min_width and min(level.size) >= 2:
+            # through the base class, as JPEG 2000 images shadow reduce()
+            # with their reduce-on-decode setting
+            level = PIL.Image.Image.reduce(level, 2)
+            self.levels.append(level)
+        for level in reversed(self.levels):
+            if level.size[0] >= min_width:
+                return level
+        return self.levels[0]
+
+    def render(self, scaling, box, display_size, resample=PIL.Image.BILINEAR):
+        """Returns part 'box' (in image coords) scaled to display_size"""
+        level = self.get_level(scaling)
+        x_scale = float(level.size[0])/float(self.image_size[0])
+        y_scale = float(level.size[1])/float(self.image_size[1])
+        # resize() only reads the pixels inside the box
+        return level.resize(display_size, resample,
+                            box=(box[0]*x_scale, box[1]*y_scale,
+                                 box[2]*x_scale, box[3]*y_scale))
+
+def get_cache_dirname():
+    """Returns name of the folder where this user's caches are kept"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'ptagtool')
+
+class DiskCache(object):
+    """
+    Thread-safe LRU cache of scaled images in files on local disk, shared
+    by all sessions, bounded by total file size.  An entry's file name is a
+    hash of the image's path, modification time and size and the size it
+    was scaled for, so changed images are never served stale
+    """
+    def __init__(self, dirname, max_bytes):
+        """Constructor"""
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # total size of the cache's files, counted on first put()
+        self.nbytes = None
+
+    def get_path(self, filename, canvas_size):
+        """Returns path of the cache file of image scaled for canvas_size,
+        or None if the image cannot be found"""
+        try:
+            stat = os.stat(split_frame(filename)[0])
+        except OSError:
+            return None
+        key = '%s\0%d\0%d\0%dx%d' % (os.path.abspath(filename),
+                                      stat.st_mtime_ns, stat.st_size,
+                                      canvas_size[0], canvas_size[1])
+        digest = hashlib.sha1(os.fsencode(key)).hexdigest()
+        return os.path.join(self.dirname, digest[:2], digest[2:])
+
+    def get(self, filename, canvas_size):
+        """Returns (scaled image, original size) if cached, or None"""
+        path = self.get_path(filename, canvas_size)
+        if path is None:
+            return None
+        header_size = len(DISK_CACHE_MAGIC)+8
+        try:
+            with open(path, 'rb') as filehandle:
+                data = filehandle.read()
+            if data[:len(DISK_CACHE_MAGIC)] != DISK_CACHE_MAGIC:
+                raise ValueError('not a cache file')
+            image_size = struct.unpack_from('<II', data,
+                                            len(DISK_CACHE_MAGIC))
+            image = PIL.Image.open(io.BytesIO(data[header_size:]))
+            image.load()
+        except FileNotFoundError:
+            return None
+        except (IOError, OSError, ValueError, struct.error):
+            # truncated or otherwise damaged, make it again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # recently used files are evicted last
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image, image_size
+
+    def put(self, filename, canvas_size, image, image_size):
+        """Add scaled image to cache, evicting least recently used ones"""
+        path = self.get_path(filename, canvas_size)
+        if path is None:
+            return
+        data = io.BytesIO()
+        data.write(DISK_CACHE_MAGIC)
+        data.write(struct.pack('<II', *image_size))
+        # e.g. float (F), 32-bit (I) and CMYK images cannot be saved as PNG,
+        # convert them to the RGB or L mode they are based on
+        if image.mode not in DISK_CACHE_PNG_MODES+('RGB', 'L'):
+            image = image.convert(PIL.Image.getmodebase(image.mode))
+        # write to a temporary file and rename it, other sessions may be
+        # reading the cache
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            if image.mode in ('RGB', 'L'):
+                image.save(data, 'JPEG', quality=DISK_CACHE_QUALITY)
+            else:
+                image.save(data, 'PNG', compress_level=1)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as filehandle:
+                filehandle.write(data.getvalue())
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as error:
+            print('\tWarning: cannot write to disk cache: %s' % error)
+            return
+        with self.lock:
+            if self.nbytes is None:
+                self.nbytes = sum(size for _, size, _ in self.list_files())
+            else:
+                self.nbytes += len(data.getvalue())
+            if self.nbytes > self.max_bytes:
+                self.evict()
+
+    def list_files(self):
+        """Returns list of (mtime, size, path) of the cache's files"""
+        files = []
+        try:
+            subdirs = list(os.scandir(self.dirname))
+        except OSError:
+            return files
+        for subdir in subdirs:
+            try:
+                for dir_entry in os.scandir(subdir.path):
+                    stat = dir_entry.stat()
+                    files.append((stat.st_mtime, stat.st_size,
+                                  dir_entry.path))
+            except OSError:
+                continue
+        return files
+
+    def evict(self):
+        """Remove least recently used files, down to 90% of the budget"""
+        files = sorted(self.list_files())
+        self.nbytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.nbytes <= 0.9*self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.nbytes -= size
+
+class ImagePrefetcher(object):
+    """Loads scaled images, decoding likely-next ones in background threads"""
+    def __init__(self, cache, num_threads=NUM_PREFETCH_THREADS,
+                 max_decode_bytes=DECODE_MEGABYTES*1024*1024,
+                 disk_cache=None):
+        """Constructor"""
+        self.cache = cache
+        self.max_decode_bytes = max_decode_bytes
+        # scaled images kept across sessions, if any
+        self.disk_cache = disk_cache
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        # maps key to future of a background load that was asked for
+        self.futures = {}
+
+    def load(self, filename, canvas_size):
+        """Returns (scaled image, original size) - blocks if not prefetched"""
+        key = (filename, canvas_size)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        future = self.futures.pop(key, None)
+        if future is not None and not future.cancel():
+            # already being decoded, wait for it rather than start over
+            return future.result()
+        return self.load_into_cache(key)
+
+    def prefetch(self, filenames, canvas_size):
+        """Decode and scale given images in the background, in given order"""
+        keys = [(filename, canvas_size) for filename in filenames]
+        # drop requests that are no longer wanted, if not yet started
+        for key in list(self.futures):
+            if key not in keys or self.futures[key].done():
+                self.futures.pop(key).cancel()
+        for key in keys:
+            if key not in self.futures and key not in self.cache:
+                self.futures[key] = self.executor.submit(self.load_into_cache,
+                                                         key)
+
+    def load_into_cache(self, key):
+        """Decode and scale image, add it to the cache and return it"""
+        filename, canvas_size = key
+        result = None
+        if self.disk_cache is not None:
+            result = self.disk_cache.get(filename, canvas_size)
+        if result is not None:
+            image_scaled, image_size = result
+        else:
+            image_scaled, image_size = load_scaled_image(
+                filename, canvas_size, self.max_decode_bytes)
+            if self.disk_cache is not None:
+                # don't hold up showing the image while it is saved
+                self.executor.submit(self.disk_cache.put, filename,
+                                     canvas_size, image_scaled, image_size)
+        self.cache.put(key, (image_scaled, image_size),
+                       get_image_nbytes(image_scaled))
+        return image_scaled, image_size
+
+    def shutdown(self):
+        """Stop background threads, abandoning prefetches not yet started"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 def on_mousewheel(listbox, i_button, n_units=5):
     """Mouse wheel move callback"""
     if i_button == 5:
         listbox.yview(SCROLL, n_units, UNITS)
     if i_button == 4:
         listbox.yview(SCROLL, -n_units, UNITS)
+    # the listbox must not scroll itself as well
+    return 'break'
+
+class VirtualList(object):
+    """
+    A long list shown in side-by-side Listboxes that only ever hold the
+    rows that are visible, so that showing a million rows costs as much as
+    showing a screenful.  Scrolls with a Scrollbar, like a Listbox.
+    """
+    def __init__(self, listboxes, scrollbar, get_row, count, font):
+        """Constructor"""
+        self.listboxes = listboxes
+        self.scrollbar = scrollbar
+        # get_row(i) returns the i'th row's text in each of the listboxes
+        self.get_row = get_row
+        self.count = count
+        self.font = font
+        # index of the first visible row
+        self.top = 0
+        # index of the selected row, or -1
+        self.selected = -1
+        # index of a row shown as selected instead of the selected one,
+        # while moving through the list, or -1
+        self.cursor = -1
+        # number of rows that fit in the listboxes (updated upon display)
+        self.num_rows = int(listboxes[0]['height'])
+        listboxes[0].bind('<Configure>', self.on_configure)
+
+    def on_configure(self, event):
+        """Listbox resize callback: show as many rows as now fit"""
+        listbox = self.listboxes[0]
+        inset = 2*(int(listbox['borderwidth'])+
+                   int(listbox['highlightthickness']))
+        row_height = self.font.metrics('linespace')+1+\
+            2*int(listbox['selectborderwidth'])
+        num_rows = max(1, (event.height-inset)//row_height)
+        if num_rows != self.num_rows:
+            self.num_rows = num_rows
+            self.scroll_to(self.top)
+
+    def set_count(self, count):
+        """Change number of rows in the list"""
+        self.count = count
+        self.scroll_to(self.top)
+
+    def scroll_to(self, top):
+        """Make top'th row the first visible one, and redisplay"""
+        self.top = max(0, min(top, self.count-self.num_rows))
+        self.refresh()
+
+    def refresh(self):
+        """Fill the listboxes with the visible rows"""
+        rows = [self.get_row(i) for i in self.get_visible()]
+        shown = self.get_shown_selection()
+        for column, listbox in enumerate(self.listboxes):
+            listbox.delete(0, END)
+            listbox.insert(END, *[row[column] for row in rows])
+            # undo any scrolling a listbox may have done on its own
+            listbox.yview(MOVETO, 0)
+            if self.top <= shown < self.top+len(rows):
+                listbox.selection_set(shown-self.top)
+        if self.count > 0:
+            self.scrollbar.set(float(self.top)/self.count,
+                               float(self.top+len(rows))/self.count)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def refresh_row(self, i):
+        """Redisplay i'th row, if visible"""
+        if not self.top <= i < self.top+self.num_rows or i >= self.count:
+            return
+        row = self.get_row(i)
+        for column, listbox in enumerate(self.listboxes):
+            listbox.delete(i-self.top)
+            listbox.insert(i-self.top, row[column])
+            if i == self.get_shown_selection():
+                listbox.selection_set(i-self.top)
+
+    def get_visible(self):
+        """Returns range of indices of the visible rows"""
+        return range(self.top, min(self.top+self.num_rows, self.count))
+
+    def see(self, i):
+        """Scroll so that i'th row is visible"""
+        if i < self.top:
+            self.scroll_to(i)
+        elif i >= self.top+self.num_rows:
+            self.scroll_to(i-self.num_rows+1)
+        else:
+            self.refresh()
+
+    def get_shown_selection(self):
+        """Returns index of the row shown as selected"""
+        return self.cursor if self.cursor >= 0 else self.selected
+
+    def select(self, i):
+        """Select i'th row and scroll so that it is visible"""
+        self.selected = i
+        self.cursor = -1
+        self.see(i)
+
+    def move_cursor(self, i):
+        """Show i'th row as selected, without selecting it, and scroll so
+        that it is visible"""
+        self.cursor = i
+        self.see(i)
+
+    def nearest(self, y_coord):
+        """Returns index of row nearest to y_coord (in listbox pixels)"""
+        return min(self.top+self.listboxes[0].nearest(y_coord),
+                   self.count-1)
+
+    def yview(self, *args):
+        """Scroll like Listbox.yview(), scrollbar callback"""
+        if args[0] == MOVETO:
+            self.scroll_to(int(float(args[1])*self.count))
+        elif args[0] == SCROLL:
+            if args[2] == UNITS:
+                self.scroll_to(self.top+int(args[1]))
+            else:
+                self.scroll_to(self.top+int(args[1])*self.num_rows)
+
+def probe_image_size(filename):
+    """Returns (width, height) of a PIL-openable image file, or None"""
+    try:
+        # PIL.Image.open() only reads the header; close the file right away
+        # so that scanning huge trees does not run out of file descriptors
+        with PIL.Image.open(filename) as image:
+            return image.size
+    except IOError:
+        return None
+
+def get_frame_pages(image):
+    """Returns list of [page number, width, height] of the frames of an
+    opened image, or None if it is a single image"""
+    if image.format not in MULTI_FRAME_FORMATS or \
+       getattr(image, 'n_frames', 1) < 2:
+        return None
+    if image.format != 'TIFF':
+        # all frames of a GIF are the size of its logical screen
+        return [[page, image.size[0], image.size[1]]
+                for page in range(image.n_frames)]
+    pages = []
+    for page in range(image.n_frames):
+        # seeking a TIFF only reads the page's tags, not its pixels
+        image.seek(page)
+        # pages that are reduced-resolution versions of another page (bit 0
+        # of NewSubfileType) are not frames of their own
+        if not image.tag_v2.get(254, 0) & 1:
+            pages.append([page, image.size[0], image.size[1]])
+    return pages if len(pages) > 1 else None
+
+def probe_image(filename):
+    """Returns ((width, height), [page number, width, height] of its frames
+    or None) of a PIL-openable image file, or None"""
+    try:
+        with PIL.Image.open(filename) as image:
+            size = image.size
+            return size, get_frame_pages(image)
+    except (IOError, EOFError):
+        return None
 
 def is_image_file(filename):
     """Returns whether filename is an image file that's PIL-openable"""
+    return probe_image_size(filename) is not None
+
+def has_image_magic(filename):
+    """Returns whether filename starts with a known image magic number"""
     try:
-        PIL.Image.open(filename)
-        return True
+        with open(filename, 'rb') as filehandle:
+            header = filehandle.read(MAGIC_HEADER_SIZE)
     except IOError:
         return False
+    return header.startswith(IMAGE_MAGIC_PREFIXES)
 
-def walker(path, filenames):
-    """Recursive image file search (follows symlinked folders)"""
+def is_candidate_file(filename):
+    """Returns whether filename may be an image and is worth probing"""
+    # svn stores a copy of the image so ignore those
+    if filename.endswith('.svn-base'):
+        return False
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in PIL.Image.registered_extensions():
+        return True
+    if extension in NON_IMAGE_EXTENSIONS:
+        return False
+    return has_image_magic(filename)
+
+def is_link_inside(full_path, real_root):
+    """Returns whether full_path is a symbolic link to somewhere inside
+    real_root, whose real path is searched anyway"""
+    if not os.path.islink(full_path):
+        return False
+    real_path = os.path.realpath(full_path)
+    return os.path.commonpath([real_path, real_root]) == real_root
+
+def walk_files(path, real_root=None):
+    """Recursive file search (follows symlinked folders), yields full paths"""
+    if real_root is None:
+        real_root = os.path.realpath(path)
     for root, dirs, files in os.walk(path):
+        # never descend into the tool's own bookkeeping folder
+        if DATA_DIRNAME in dirs:
+            dirs.remove(DATA_DIRNAME)
         # collect full paths for all files recursively found
         for filename in files:
-            # svn stores a copy of the image so ignore those
-            if filename[len(filename)-9:] != ".svn-base":
-                full_path = os.path.join(root, filename)
-                if is_image_file(full_path):
-                    filenames.append(full_path)
-        # also walk directories that are symbolic links
+            yield os.path.join(root, filename)
+        # also walk directories that are symbolic links - except those to
+        # folders inside path, which are listed under their real path
         for dirname in dirs:
-            if os.path.islink(os.path.join(root, dirname)):
-                walker(os.path.join(root, dirname), filenames)
+            link = os.path.join(root, dirname)
+            if os.path.islink(link) and not is_link_inside(link, real_root):
+                for full_path in walk_files(link, real_root):
+                    yield full_path
+
+def walker(path, filenames, num_threads=NUM_PROBE_THREADS):
+    """Recursive image file search (follows symlinked folders)"""
+    # cheap rejection first: extension and magic bytes, no PIL involved
+    candidates = [full_path for full_path in walk_files(path)
+                  if is_candidate_file(full_path)]
+    # probe remaining candidates with PIL, a bounded number at a time
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for full_path, probe in zip(candidates,
+                                    executor.map(probe_image, candidates)):
+            if probe is None:
+                continue
+            if probe[1] is None:
+                filenames.append(full_path)
+            else:
+                # each frame of a multi-frame file is an image of its own
+                filenames.extend(get_frame_filename(full_path, page)
+                                 for page, _, _ in probe[1])
     return filenames
 
 def find_image_files(path):
@@ -487,45 +2143,1252 @@ def find_image_files(path):
     filenames.sort()
     return filenames
 
+class ImageManifest(object):
+    """On-disk record of a dataset's image files, used to skip re-scanning"""
+    def __init__(self, path):
+        """Constructor"""
+        self.path = path
+        self.filename = os.path.join(path, DATA_DIRNAME, MANIFEST_FILENAME)
+
+        # maps directory path (relative to self.path, '' is the root) to
+        # a dict with keys 'mtime' (ns), 'subdirs' (list of names) and
+        # 'files', mapping filename to [size, mtime (ns), width, height,
+        # has_pts, frames, labeled pages] - width and height (of the first
+        # frame, for multi-frame files) are None for non-image files, frames
+        # is the list of [page number, width, height] of the frames of a
+        # multi-frame file (None for other files) and labeled pages the
+        # page numbers of those frames that have a .pts file
+        self.directories = {}
+
+        # maps full image filename (or frame name) to its file's entry in
+        # self.directories
+        self.images = {}
+
+        # maps full filename of a multi-frame file to the set of page
+        # numbers of its frames that have a .pts file
+        self.labeled_pages = {}
+
+        # maps full filename of a multi-frame file to a dict mapping the
+        # page number of each of its frames to the frame's (width, height)
+        self.frame_sizes = {}
+
+    def load(self):
+        """Read manifest file, if there is a usable one"""
+        try:
+            with open(self.filename, 'r') as filehandle:
+                contents = json.load(filehandle)
+        except (IOError, ValueError):
+            return
+        if contents.get('version') == MANIFEST_VERSION:
+            self.directories = contents['directories']
+
+    def save(self):
+        """Write manifest file, atomically replacing the previous one"""
+        contents = {'version': MANIFEST_VERSION,
+                    'directories': self.directories}
+        # other instances may be saving it too
+        tmp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.mkdir(os.path.dirname(self.filename))
+            with open(tmp_filename, 'w') as filehandle:
+                json.dump(contents, filehandle, separators=(',', ':'))
+            os.replace(tmp_filename, self.filename)
+        except IOError as error:
+            print('\tWarning: cannot save scan manifest: %s' % error)
+
+    def scan(self, num_threads=NUM_PROBE_THREADS):
+        """Update manifest from the file system, returns image filenames"""
+        for _ in self.iter_scan(num_threads):
+            pass
+        return sorted(self.images)
+
+    def iter_scan(self, num_threads=NUM_PROBE_THREADS):
+        """
+        Update manifest from the file system, one directory at a time.
+        Yields sorted list of the image filenames in each directory, with
+        directories in (roughly) sorted order.
+        """
+        old_directories = self.directories
+        self.directories = {}
+        self.images = {}
+        self.labeled_pages = {}
+        self.frame_sizes = {}
+        # real paths of directories seen so far, guards against link cycles
+        visited = set()
+        real_root = os.path.realpath(self.path)
+        # ignore (i.e. always revalidate) directories modified just now
+        mtime_limit = int((time.time()-MANIFEST_MTIME_SLACK)*1e9)
+        # directories whose files are still being probed, in order found,
+        # as (rel_dir, directory, list of (file entry, future of its size))
+        pending = deque()
+        num_probes = 0
+        stack = ['']
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            while stack or pending:
+                # hand over directories in order, as soon as their probes
+                # are done - or to bound the number of probes in flight
+                while pending and (not stack or num_probes > PROBE_BACKLOG or
+                                   all(future.done() for _, future in
+                                       pending[0][2])):
+                    rel_dir, directory, probes = pending.popleft()
+                    num_probes -= len(probes)
+                    filenames = self.add_images(rel_dir, directory, probes)
+                    if filenames:
+                        yield filenames
+                if not stack:
+                    continue
+                rel_dir = stack.pop()
+                full_dir = os.path.join(self.path, rel_dir)
+                try:
+                    mtime = os.stat(full_dir).st_mtime_ns
+                except OSError:
+                    continue
+                real_dir = os.path.realpath(full_dir)
+                if real_dir in visited:
+                    continue
+                visited.add(real_dir)
+                directory = old_directories.get(rel_dir)
+                # (file entry, full path) of files whose contents must be
+                # probed
+                to_probe = []
+                if directory is None or directory['mtime'] != mtime:
+                    directory = self.revalidate(full_dir, directory, to_probe,
+                                                real_root)
+                    directory['mtime'] = mtime if mtime < mtime_limit else None
+                self.directories[rel_dir] = directory
+                # probe new or modified candidate files in the background
+                probes = [(entry, executor.submit(probe_image, full_path))
+                          for entry, full_path in to_probe]
+                num_probes += len(probes)
+                pending.append((rel_dir, directory, probes))
+                # visit subdirectories in sorted order, depth first
+                stack.extend(os.path.join(rel_dir, dirname) for dirname in
+                             sorted(directory['subdirs'], reverse=True))
+
+    def add_images(self, rel_dir, directory, probes):
+        """Record probed sizes, returns sorted image filenames of directory"""
+        for entry, future in probes:
+            probe = future.result()
+            if probe is not None:
+                (entry[2], entry[3]), entry[5] = probe
+        filenames = []
+        for filename, entry in directory['files'].items():
+            if entry[2] is None:
+                continue
+            full_path = os.path.join(self.path, rel_dir, filename)
+            if entry[5] is None:
+                self.images[full_path] = entry
+                filenames.append(full_path)
+                continue
+            # each frame of a multi-frame file is an image of its own
+            self.labeled_pages[full_path] = set(entry[6])
+            if entry[4] and entry[5][0][0] == 0 and \
+               not self.has_stem_image(filename, directory['files']):
+                # the file was tagged as a single image, see find_pts_file()
+                self.labeled_pages[full_path].add(0)
+            self.frame_sizes[full_path] = dict(
+                (page, (width, height)) for page, width, height in entry[5])
+            for page, _, _ in entry[5]:
+                frame_filename = get_frame_filename(full_path, page)
+                self.images[frame_filename] = entry
+                filenames.append(frame_filename)
+        filenames.sort()
+        return filenames
+
+    @staticmethod
+    def has_stem_image(name, files):
+        """Returns whether files (of a directory record) have an image other
+        than name with the same name, but for the extension"""
+        stem = os.path.splitext(name)[0]
+        return any(other != name and os.path.splitext(other)[0] == stem and
+                   entry[2] is not None for other, entry in files.items())
+
+    @staticmethod
+    def revalidate(full_dir, directory, to_probe, real_root):
+        """Returns up-to-date record of a directory, reusing old entries"""
+        old_files = directory['files'] if directory is not None else {}
+        files = {}
+        subdirs = []
+        try:
+            dir_entries = list(os.scandir(full_dir))
+        except OSError:
+            dir_entries = []
+        names = set(dir_entry.name for dir_entry in dir_entries)
+        # maps name of a multi-frame file to page numbers of its frames
+        # that have a .pts file
+        labeled_pages = {}
+        for name in names:
+            if name.endswith('.pts'):
+                filename, page = split_frame(name[:-len('.pts')])
+                if page is not None:
+                    labeled_pages.setdefault(filename, []).append(page)
+        for dir_entry in dir_entries:
+            try:
+                if dir_entry.is_dir():
+                    # folders inside the root are scanned under their real
+                    # path, not under the links to them
+                    if dir_entry.name != DATA_DIRNAME and not \
+                       (dir_entry.is_symlink() and
+                        is_link_inside(dir_entry.path, real_root)):
+                        subdirs.append(dir_entry.name)
+                    continue
+                if not dir_entry.is_file() or \
+                   dir_entry.name.endswith('.pts'):
+                    continue
+                stat = dir_entry.stat()
+            except OSError:
+                continue
+            has_pts = os.path.splitext(dir_entry.name)[0]+'.pts' in names
+            pages = sorted(labeled_pages.get(dir_entry.name, []))
+            entry = old_files.get(dir_entry.name)
+            if entry is not None and entry[0] == stat.st_size and \
+               entry[1] == stat.st_mtime_ns:
+                # unchanged file, no need to probe it again
+                entry = [entry[0], entry[1], entry[2], entry[3], has_pts,
+                         entry[5], pages]
+            else:
+                entry = [stat.st_size, stat.st_mtime_ns, None, None, has_pts,
+                         None, pages]
+                if is_candidate_file(dir_entry.path):
+                    to_probe.append((entry, dir_entry.path))
+            files[dir_entry.name] = entry
+        return {'mtime': None, 'subdirs': subdirs, 'files': files}
+
+    def has_pts_file(self, image_filename):
+        """Returns whether image had a .pts file when last scanned"""
+        filename, page = split_frame(image_filename)
+        if page is not None and filename in self.labeled_pages:
+            return page in self.labeled_pages[filename]
+        return self.images[image_filename][4]
+
+    def get_image_size(self, image_filename):
+        """Returns (width, height) of image, as recorded when last scanned"""
+        filename, page = split_frame(image_filename)
+        if page is not None and filename in self.frame_sizes:
+            return self.frame_sizes[filename][page]
+        entry = self.images[image_filename]
+        return entry[2], entry[3]
+
+def scan_image_files(path):
+    """Find all image files recursively in 'path', using a scan manifest"""
+    manifest = ImageManifest(path)
+    manifest.load()
+    filenames = manifest.scan()
+    manifest.save()
+    return filenames, manifest
+
+###############################################################################
+
+def sort_face_points(points):
+    """
+    Reorder 3 face points in place, so that they are the person's right
+    eye, left eye and mouth, in that order.  Returns whether the order
+    changed - lists of other than 3 points are left alone.
+    """
+    if len(points) != 3:
+        return False
+    original = [list(pair) for pair in points]
+    # step 1 sort the points according to y-value
+    points.sort(key=lambda pt: pt[1])
+    # step 2: from the top-most two points, call the leftmost one
+    # the person's right eye and call the other the person's left eye
+    if points[0][0] > points[1][0]:
+        points[0], points[1] = points[1], points[0]
+    return points != original
+
+def points_to_array(points):
+    """Returns points (a sequence of (x, y) pairs) as an (N, 2) float array"""
+    return numpy.array(points, dtype=numpy.float64).reshape(-1, 2)
+
+def transform_points(points, scale, x_offset, y_offset):
+    """Returns (N, 2) array of points scaled, then shifted by the offsets"""
+    return points*scale+numpy.array([x_offset, y_offset])
+
+def inverse_transform_points(points, scale, x_offset, y_offset):
+    """Returns (N, 2) array of points shifted back by the offsets, unscaled"""
+    return (points-numpy.array([x_offset, y_offset]))/scale
+
+def find_nearest_point(points, x_coord, y_coord, radius):
+    """Returns index of the point of an (N, 2) array nearest to (x, y)
+    within radius, or -1"""
+    if len(points) == 0:
+        return -1
+    # a single vectorized pass - points change with every click, so an
+    # index would have to be rebuilt about as often as it is used
+    distances = numpy.hypot(points[:, 0]-x_coord, points[:, 1]-y_coord)
+    nearest = int(numpy.argmin(distances))
+    if distances[nearest] > radius:
+        return -1
+    return nearest
+
+def crop_patches(image, corners, size):
+    """Returns (N, size, size) array of the square patches of a 2D image
+    with given top-left corners, clamped to the image"""
+    offsets = numpy.arange(size)
+    rows = numpy.clip(corners[:, 1, None]+offsets, 0, image.shape[0]-1)
+    cols = numpy.clip(corners[:, 0, None]+offsets, 0, image.shape[1]-1)
+    return image[rows[:, :, None], cols[:, None, :]]
+
+def get_window_sums(patches, size):
+    """Returns sums of each size x size window of each of (N, H, W)
+    patches, an (N, H-size+1, W-size+1) array, from integral images"""
+    sums = numpy.zeros((patches.shape[0], patches.shape[1]+1,
+                        patches.shape[2]+1))
+    sums[:, 1:, 1:] = patches.cumsum(axis=1).cumsum(axis=2)
+    return (sums[:, size:, size:]-sums[:, :-size, size:]-
+            sums[:, size:, :-size]+sums[:, :-size, :-size])
+
+def get_peak_offsets(scores, rows, cols):
+    """Returns sub-pixel (x, y) offsets of peaks of (N, H, W) scores at
+    given integer rows and columns, from parabolas through neighbours"""
+    index = numpy.arange(len(scores))
+    height, width = scores.shape[1:]
+    center = scores[index, rows, cols]
+    offsets = []
+    for before, after, inside in (
+            (scores[index, rows, numpy.maximum(cols-1, 0)],
+             scores[index, rows, numpy.minimum(cols+1, width-1)],
+             (cols > 0) & (cols < width-1)),
+            (scores[index, numpy.maximum(rows-1, 0), cols],
+             scores[index, numpy.minimum(rows+1, height-1), cols],
+             (rows > 0) & (rows < height-1))):
+        curvature = before-2.0*center+after
+        offset = numpy.zeros(len(scores))
+        peaked = inside & (curvature < 0)
+        offset[peaked] = 0.5*(before-after)[peaked]/curvature[peaked]
+        offsets.append(numpy.clip(offset, -0.5, 0.5))
+    return numpy.stack(offsets, axis=1)
+
+def match_points(image, next_image, points, patch_radius=MATCH_PATCH_RADIUS,
+                 search_radius=MATCH_SEARCH_RADIUS):
+    """
+    Returns (points, scores): where each of (N, 2) points of 2D array image
+    is in 2D array next_image, found by normalized cross-correlation of the
+    patch around it with its surroundings in next_image - all points at
+    once, via FFT.  Scores are the correlations, near 1 for good matches
+    """
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    size = 2*patch_radius+1
+    window = size+2*search_radius
+    corners = numpy.round(points).astype(numpy.int64)-patch_radius
+    templates = crop_patches(image, corners, size).astype(numpy.float64)
+    windows = crop_patches(next_image, corners-search_radius,
+                           window).astype(numpy.float64)
+
+    # zero-mean templates, so that brightness changes do not matter
+    templates -= templates.mean(axis=(1, 2), keepdims=True)
+    template_norms = numpy.sqrt((templates**2).sum(axis=(1, 2)))
+
+    # correlate each window with its template at every offset, the ones
+    # where the template is wholly inside the window are not wrapped around
+    correlations = numpy.fft.irfft2(
+        numpy.fft.rfft2(windows)*numpy.conj(
+            numpy.fft.rfft2(templates, s=(window, window))),
+        s=(window, window))[:, :window-size+1, :window-size+1]
+
+    # normalize by the energy of the window under the template
+    sums = get_window_sums(windows, size)
+    variances = get_window_sums(windows**2, size)-sums**2/(size*size)
+    norms = template_norms[:, None, None]*numpy.sqrt(
+        numpy.maximum(variances, 0.0))
+    scores = numpy.zeros_like(correlations)
+    numpy.divide(correlations, norms, out=scores, where=norms > 1e-9)
+
+    peaks = scores.reshape(len(points), -1).argmax(axis=1)
+    rows, cols = numpy.divmod(peaks, scores.shape[2])
+    shifts = numpy.stack([cols, rows], axis=1)-search_radius+\
+        get_peak_offsets(scores, rows, cols)
+    return points+shifts, scores[numpy.arange(len(points)), rows, cols]
+
+def load_gray_image(filename, max_decode_bytes=DECODE_MEGABYTES*1024*1024):
+    """Returns (2D float32 array of image's brightness, its scale relative
+    to the original image size)"""
+    image, image_size = open_image(filename, None, max_decode_bytes)
+    with image:
+        gray = numpy.asarray(image.convert('L'), dtype=numpy.float32)
+    return gray, float(gray.shape[1])/float(image_size[0])
+
+class PointPropagator(object):
+    """Predicts the points of images from those of the images before them,
+    by template matching, in a background thread"""
+    def __init__(self, max_decode_bytes=DECODE_MEGABYTES*1024*1024,
+                 profiler=None):
+        """Constructor"""
+        self.max_decode_bytes = max_decode_bytes
+        self.profiler = profiler if profiler is not None else \
+            LatencyProfiler(enabled=False)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # maps filename to (gray image, scale) of the images loaded last -
+        # the image predicted now is usually the one predicted from next
+        self.images = OrderedDict()
+
+    def predict(self, filename, points, next_filename):
+        """Returns future of (N, 2) array of predicted points of image
+        next_filename, from points of image filename"""
+        return self.executor.submit(self.run, filename, points, next_filename)
+
+    def load(self, filename):
+        """Returns (gray image, scale) of image, from cache if possible"""
+        if filename not in self.images:
+            self.images[filename] = load_gray_image(filename,
+                                                    self.max_decode_bytes)
+            while len(self.images) > 2:
+                self.images.popitem(last=False)
+        return self.images[filename]
+
+    def run(self, filename, points, next_filename):
+        """Background thread: predicts points of next_filename"""
+        with self.profiler.stage('predict'):
+            image, scale = self.load(filename)
+            next_image, next_scale = self.load(next_filename)
+            points = numpy.array(points, dtype=numpy.float64)
+            if image.shape != next_image.shape or len(points) == 0:
+                # different sizes, can't be consecutive frames
+                return points
+            matched, scores = match_points(image, next_image, points*scale)
+            good = scores >= MIN_MATCH_SCORE
+            points[good] = matched[good]/next_scale
+            return points
+
+    def shutdown(self):
+        """Stop background thread, abandoning predictions not yet started"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def get_pts_filename(image_filename):
+    """Returns filename of the .pts file that goes with an image file"""
+    if split_frame(image_filename)[1] is not None:
+        # one .pts file per frame, named after the frame
+        return image_filename+'.pts'
+    return os.path.splitext(image_filename)[0]+'.pts'
+
+def get_legacy_pts_filename(image_filename):
+    """Returns name of the .pts file that the first frame of a multi-frame
+    file was tagged in, as a single image, before the file's frames were
+    listed - or None if image is not such a frame, or if another image
+    may own that .pts file"""
+    legacy_filename = get_legacy_filename(image_filename)
+    if legacy_filename is None:
+        return None
+    pts_filename = get_pts_filename(legacy_filename)
+    # the .pts file may as well be another image's, e.g. of a.jpg next to
+    # a.tif - leave it alone then
+    stem = os.path.splitext(legacy_filename)[0]
+    for other in glob.glob(glob.escape(stem)+'.*'):
+        if other not in (legacy_filename, pts_filename) and \
+           is_candidate_file(other) and probe_image_size(other) is not None:
+            return None
+    return pts_filename
+
+def find_pts_file(image_filename):
+    """Returns name of the .pts file that image's points are saved in, or
+    None if there is none"""
+    pts_filename = get_pts_filename(image_filename)
+    if os.path.exists(pts_filename):
+        return pts_filename
+    legacy_filename = get_legacy_filename(image_filename)
+    if legacy_filename is None or \
+       not os.path.exists(get_pts_filename(legacy_filename)):
+        return None
+    return get_legacy_pts_filename(image_filename)
+
+class PtsFileStore(object):
+    """Annotation store that keeps points in a .pts file next to each image"""
+    def __init__(self, manifest=None):
+        """Constructor"""
+        # scan manifest, if any, tells which images had .pts files at startup
+        self.manifest = manifest
+
+    def has_points(self, image_filename):
+        """Returns whether image has saved points"""
+        return find_pts_file(image_filename) is not None
+
+    def find_labeled(self, image_filenames):
+        """Returns set of given image filenames that have saved points"""
+        if self.manifest is not None:
+            return set(image_filename for image_filename in image_filenames
+                       if self.manifest.has_pts_file(image_filename))
+        return set(image_filename for image_filename in image_filenames
+                   if self.has_points(image_filename))
+
+    def read_points(self, image_filename):
+        """Returns list of points (lists) saved for image"""
+        pts_filename = find_pts_file(image_filename)
+        if pts_filename is None:
+            return []
+        filehandle = open(pts_filename, 'r')
+        lines = filehandle.readlines()
+        filehandle.close()
+        return [[float(pair[0]), float(pair[1])]
+                for pair in [line.split(',') for line in lines]]
+
+    def write_points(self, image_filename, points):
+        """Save points for image, an empty list removes saved points"""
+        pts_filename = get_pts_filename(image_filename)
+        if len(points) == 0:
+            if os.path.exists(pts_filename):
+                os.remove(pts_filename)
+            self.remove_legacy_pts_file(image_filename)
+            return
+        # write to a temporary file and rename it over the old one, so that
+        # the .pts file always holds either the old or the new points
+        message = ''.join(str(pair[0])+', '+str(pair[1])+'\n'
+                          for pair in points)
+        tmp_filename = '%s.%d.tmp' % (pts_filename, os.getpid())
+        with open(tmp_filename, 'w') as filehandle:
+            filehandle.write(message)
+            filehandle.flush()
+            os.fsync(filehandle.fileno())
+        os.replace(tmp_filename, pts_filename)
+        self.remove_legacy_pts_file(image_filename)
+
+    @staticmethod
+    def remove_legacy_pts_file(image_filename):
+        """Remove the .pts file of the first frame of a multi-frame file
+        saved when it was tagged as a single image, as the points saved now
+        replace it"""
+        legacy_pts_filename = get_legacy_pts_filename(image_filename)
+        if legacy_pts_filename is not None and \
+           os.path.exists(legacy_pts_filename):
+            os.remove(legacy_pts_filename)
+
+    def close(self):
+        """Release resources, nothing to do for .pts files"""
+
+class SqliteStore(object):
+    """Annotation store that keeps all points in a single SQLite file"""
+    def __init__(self, db_filename, path):
+        """Constructor"""
+        # images are keyed by their path relative to the dataset's root
+        # folder, so that the dataset (and its database) can be moved
+        self.path = path
+        # the connection is shared with background threads, so serialize
+        # all access to it
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_filename,
+                                          timeout=SQLITE_TIMEOUT,
+                                          check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS points ('
+                                'image TEXT PRIMARY KEY, xy BLOB NOT NULL)')
+        self.connection.commit()
+
+    def get_key(self, image_filename):
+        """Returns database key of image"""
+        return os.path.relpath(image_filename, self.path)
+
+    def get_keys(self, image_filename):
+        """Returns database keys that image's points may be saved under,
+        its own key first"""
+        keys = [self.get_key(image_filename)]
+        legacy_filename = get_legacy_filename(image_filename)
+        if legacy_filename is not None:
+            # points of the first frame of a multi-frame file may still be
+            # saved under the file's key, from before its frames were listed
+            keys.append(self.get_key(legacy_filename))
+        return keys
+
+    def has_points(self, image_filename):
+        """Returns whether image has saved points"""
+        keys = self.get_keys(image_filename)
+        # always ask the database, other annotators may have saved points
+        # since we last looked
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM points WHERE image IN (%s)' %
+                ','.join('?'*len(keys)), keys).fetchone()
+        return row is not None
+
+    def find_labeled(self, image_filenames):
+        """Returns set of given image filenames that have saved points"""
+        images = {}
+        for image_filename in image_filenames:
+            for key in self.get_keys(image_filename):
+                images[key] = image_filename
+        keys = list(images)
+        labeled = set()
+        # a query at a time for a chunk of keys, as SQLite limits the
+        # number of parameters of a query
+        for start in range(0, len(keys), SQLITE_MAX_PARAMETERS):
+            chunk = keys[start:start+SQLITE_MAX_PARAMETERS]
+            with self.lock:
+                rows = self.connection.execute(
+                    'SELECT image FROM points WHERE image IN (%s)' %
+                    ','.join('?'*len(chunk)), chunk).fetchall()
+            labeled.update(images[row[0]] for row in rows)
+        return labeled
+
+    def read_points(self, image_filename):
+        """Returns list of points (lists) saved for image"""
+        keys = self.get_keys(image_filename)
+        with self.lock:
+            rows = dict(self.connection.execute(
+                'SELECT image, xy FROM points WHERE image IN (%s)' %
+                ','.join('?'*len(keys)), keys).fetchall())
+        xy = next((rows[key] for key in keys if key in rows), None)
+        if xy is None:
+            return []
+        # x and y coordinates are interleaved, as little-endian doubles
+        coords = array('d')
+        coords.frombytes(xy)
+        if sys.byteorder != 'little':
+            coords.byteswap()
+        return [[coords[j], coords[j+1]] for j in range(0, len(coords), 2)]
+
+    def write_points(self, image_filename, points, commit=True):
+        """Save points for image, an empty list removes saved points"""
+        keys = self.get_keys(image_filename)
+        key = keys[0]
+        with self.lock:
+            if len(points) > 0:
+                coords = array('d', [coord for pair in points
+                                     for coord in pair])
+                if sys.byteorder != 'little':
+                    coords.byteswap()
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO points (image, xy) VALUES (?, ?)',
+                    (key, coords.tobytes()))
+            else:
+                self.connection.execute('DELETE FROM points WHERE image = ?',
+                                        (key,))
+            # the points now saved replace those saved under an old key
+            for legacy_key in keys[1:]:
+                self.connection.execute('DELETE FROM points WHERE image = ?',
+                                        (legacy_key,))
+            if commit:
+                self.connection.commit()
+
+    def write_many(self, items):
+        """Save (image filename, points) pairs, in a single transaction"""
+        for image_filename, points in items:
+            self.write_points(image_filename, points, commit=False)
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        """Close the database"""
+        with self.lock:
+            self.connection.close()
+
+class WriteBehindStore(object):
+    """Wraps an annotation store, saving points from a background thread"""
+    def __init__(self, store, delay=SAVE_DELAY, profiler=None):
+        """Constructor"""
+        self.store = store
+        self.profiler = profiler if profiler is not None else \
+            LatencyProfiler(enabled=False)
+        # seconds to wait after an edit before saving, further edits of
+        # the same image within that time are saved together
+        self.delay = delay
+        self.condition = threading.Condition()
+        # maps image filename to (points, time when they are due to be saved)
+        self.pending = {}
+        # (image filename, points) being saved right now, or None
+        self.writing = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_unsaved_points(self, image_filename):
+        """Returns points of image not yet saved to the store, or None"""
+        if image_filename in self.pending:
+            return self.pending[image_filename][0]
+        if self.writing is not None and self.writing[0] == image_filename:
+            return self.writing[1]
+        return None
+
+    def has_points(self, image_filename):
+        """Returns whether image has saved (or soon to be saved) points"""
+        with self.condition:
+            points = self.get_unsaved_points(image_filename)
+        if points is not None:
+            return len(points) > 0
+        return self.store.has_points(image_filename)
+
+    def find_labeled(self, image_filenames):
+        """Returns set of given image filenames that have saved points"""
+        labeled = self.store.find_labeled(image_filenames)
+        with self.condition:
+            for image_filename in image_filenames:
+                points = self.get_unsaved_points(image_filename)
+                if points is not None and len(points) > 0:
+                    labeled.add(image_filename)
+                elif points is not None:
+                    labeled.discard(image_filename)
+        return labeled
+
+    def read_points(self, image_filename):
+        """Returns list of points (lists) saved for image"""
+        with self.condition:
+            points = self.get_unsaved_points(image_filename)
+        if points is not None:
+            return [list(pair) for pair in points]
+        return self.store.read_points(image_filename)
+
+    def write_points(self, image_filename, points):
+        """Queue points of image to be saved, returns right away"""
+        with self.condition:
+            self.pending[image_filename] = ([list(pair) for pair in points],
+                                            time.time()+self.delay)
+            self.condition.notify()
+
+    def flush(self, wait=True):
+        """Save all queued points now, if wait then until they are saved"""
+        with self.condition:
+            now = time.time()
+            for image_filename, (points, _) in self.pending.items():
+                self.pending[image_filename] = (points, now)
+            self.condition.notify()
+            while wait and (self.pending or self.writing is not None):
+                self.condition.wait()
+
+    def close(self):
+        """Save all queued points, stop background thread, close store"""
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.store.close()
+
+    def run(self):
+        """Background thread: saves queued points when they are due"""
+        while True:
+            with self.condition:
+                while True:
+                    if self.pending:
+                        image_filename = min(self.pending, key=lambda f:
+                                             self.pending[f][1])
+                        due = self.pending[image_filename][1]
+                        if due <= time.time():
+                            break
+                        self.condition.wait(due-time.time())
+                    elif self.closed:
+                        return
+                    else:
+                        self.condition.wait()
+                points = self.pending.pop(image_filename)[0]
+                self.writing = (image_filename, points)
+            try:
+                with self.profiler.stage('save'):
+                    self.store.write_points(image_filename, points)
+            except (IOError, sqlite3.Error) as error:
+                print('\tError: cannot save points of %s: %s' %
+                      (image_filename, error))
+            with self.condition:
+                self.writing = None
+                self.condition.notify_all()
+
+class ClaimQueue(object):
+    """
+    Hands out images to annotators working on the same dataset at the same
+    time, with a lock file per claimed image, so that no two of them work
+    on the same image - works on shared (e.g. NFS) folders
+    """
+    def __init__(self, path, timeout=CLAIM_TIMEOUT,
+                 renew_interval=CLAIM_RENEW_INTERVAL):
+        """Constructor"""
+        self.path = path
+        self.dirname = os.path.join(path, DATA_DIRNAME, CLAIMS_DIRNAME)
+        self.timeout = timeout
+        self.renew_interval = renew_interval
+        try:
+            user = getpass.getuser()
+        except (KeyError, OSError):
+            user = 'unknown'
+        self.hostname = socket.gethostname()
+        # who this annotator is, as written in its claim files
+        self.owner = '%s@%s:%d' % (user, self.hostname, os.getpid())
+        # maps image filename claimed by this annotator to when its claim
+        # was last renewed
+        self.held = {}
+        # claim filenames of images claimed by other annotators, as of the
+        # last call to find_others()
+        self.others = set()
+        # whether claims can be written at all (e.g. not in a read-only
+        # folder) - if not, every image counts as claimed
+        self.writable = True
+
+    def get_claim_filename(self, image_filename):
+        """Returns name of the lock file of image's claim"""
+        relpath = os.path.relpath(image_filename, self.path)
+        return hashlib.sha1(os.fsencode(relpath)).hexdigest()+'.claim'
+
+    def read_claim(self, claim_path):
+        """Returns (owner, last renewal time) of a claim file, or None"""
+        try:
+            with open(claim_path, 'r') as filehandle:
+                owner = filehandle.read()
+            return owner, os.stat(claim_path).st_mtime
+        except (IOError, OSError):
+            return None
+
+    def is_stale(self, owner, mtime):
+        """Returns whether someone else's claim has lapsed"""
+        if time.time()-mtime > self.timeout:
+            return True
+        # a claim of a process on this host that is gone has lapsed too
+        host, _, pid = owner.rpartition('@')[2].rpartition(':')
+        if os.name != 'posix' or host != self.hostname or \
+           not pid.isdigit():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def claim(self, image_filename):
+        """Claim image for this annotator if no one else has, returns
+        the claim's owner - self.owner if the claim succeeded"""
+        renewed = self.held.get(image_filename)
+        if renewed is not None and time.time()-renewed < self.renew_interval:
+            return self.owner
+        if not self.writable:
+            return self.owner
+        claim_path = os.path.join(self.dirname,
+                                  self.get_claim_filename(image_filename))
+        owner = None
+        for _ in range(2):
+            try:
+                fd = os.open(claim_path, os.O_CREAT|os.O_EXCL|os.O_WRONLY,
+                             0o644)
+            except FileExistsError:
+                claim = self.read_claim(claim_path)
+                if claim is None:
+                    # released just now, try again
+                    continue
+                owner, mtime = claim
+                if owner == self.owner:
+                    self.renew([image_filename])
+                    return owner
+                if not self.is_stale(owner, mtime):
+                    return owner
+                # take over a lapsed claim - of all annotators trying to,
+                # only the one whose rename succeeds does
+                stale_path = '%s.%d.stale' % (claim_path, os.getpid())
+                try:
+                    os.rename(claim_path, stale_path)
+                except OSError:
+                    continue
+                try:
+                    if self.read_claim(stale_path) != claim:
+                        # renamed someone's fresh claim, put it back
+                        os.rename(stale_path, claim_path)
+                    else:
+                        os.remove(stale_path)
+                except OSError:
+                    pass
+                continue
+            except FileNotFoundError:
+                try:
+                    os.makedirs(self.dirname, exist_ok=True)
+                except OSError as error:
+                    return self.give_up(error)
+                continue
+            except OSError as error:
+                return self.give_up(error)
+            with os.fdopen(fd, 'w') as filehandle:
+                filehandle.write(self.owner)
+            self.held[image_filename] = time.time()
+            return self.owner
+        return owner
+
+    def give_up(self, error):
+        """Stop claiming images, when claim files cannot be written"""
+        print('\tWarning: cannot claim images, other annotators may work on '
+              'the same images: %s' % error)
+        self.writable = False
+        return self.owner
+
+    def renew(self, image_filenames):
+        """Renew claims on given images, if this annotator holds them"""
+        for image_filename in image_filenames:
+            claim_path = os.path.join(
+                self.dirname, self.get_claim_filename(image_filename))
+            claim = self.read_claim(claim_path)
+            if claim is None or claim[0] != self.owner:
+                # lapsed, and maybe claimed by someone else since
+                self.held.pop(image_filename, None)
+                continue
+            try:
+                os.utime(claim_path)
+                self.held[image_filename] = time.time()
+            except OSError:
+                self.held.pop(image_filename, None)
+
+    def keep(self, image_filenames):
+        """Renew claims on given images when due, release all others"""
+        now = time.time()
+        image_filenames = set(image_filenames)
+        for image_filename in list(self.held):
+            if image_filename not in image_filenames:
+                self.release(image_filename)
+        self.renew([image_filename for image_filename in image_filenames
+                    if image_filename in self.held and
+                    now-self.held[image_filename] >= self.renew_interval])
+
+    def release(self, image_filename):
+        """Give up this annotator's claim on image"""
+        if self.held.pop(image_filename, None) is None:
+            return
+        claim_path = os.path.join(self.dirname,
+                                  self.get_claim_filename(image_filename))
+        claim = self.read_claim(claim_path)
+        if claim is not None and claim[0] == self.owner:
+            try:
+                os.remove(claim_path)
+            except OSError:
+                pass
+
+    def release_all(self):
+        """Give up all of this annotator's claims"""
+        for image_filename in list(self.held):
+            self.release(image_filename)
+
+    def find_others(self):
+        """Update set of images claimed by other annotators"""
+        mine = set(self.get_claim_filename(image_filename)
+                   for image_filename in self.held)
+        others = set()
+        try:
+            dir_entries = list(os.scandir(self.dirname))
+        except OSError:
+            dir_entries = []
+        now = time.time()
+        for dir_entry in dir_entries:
+            if not dir_entry.name.endswith('.claim') or \
+               dir_entry.name in mine:
+                continue
+            try:
+                if now-dir_entry.stat().st_mtime <= self.timeout:
+                    others.add(dir_entry.name)
+            except OSError:
+                pass
+        self.others = others
+
+    def is_claimed_by_other(self, image_filename):
+        """Returns whether another annotator claimed image, as of the
+        last call to find_others()"""
+        return self.get_claim_filename(image_filename) in self.others
+
+def export_points(store, image_filenames, path, prefix):
+    """Write all points in store to one array plus an index, for bulk loading
+
+    Writes <prefix>.npy, an (N, 2) float64 array with the points of all
+    images one after the other, <prefix>_offsets.npy, where image i's
+    points are rows offsets[i] to offsets[i+1] of that array, and
+    <prefix>_images.txt, with image i's path relative to 'path' on line i.
+    Use load_exported_points() to read them back, memory-mapped.
+    """
+    labeled = store.find_labeled(image_filenames)
+    offsets = numpy.zeros(len(image_filenames)+1, dtype=numpy.int64)
+    chunks = []
+    for i, image_filename in enumerate(image_filenames):
+        points = store.read_points(image_filename) \
+            if image_filename in labeled else []
+        offsets[i+1] = offsets[i]+len(points)
+        if len(points) > 0:
+            chunks.append(numpy.array(points, dtype=numpy.float64))
+    if chunks:
+        points = numpy.concatenate(chunks)
+    else:
+        points = numpy.zeros((0, 2), dtype=numpy.float64)
+    numpy.save(prefix+'.npy', points)
+    numpy.save(prefix+'_offsets.npy', offsets)
+    with open(prefix+'_images.txt', 'w') as filehandle:
+        for image_filename in image_filenames:
+            filehandle.write(os.path.relpath(image_filename, path)+'\n')
+
+def load_exported_points(prefix):
+    """Returns (image paths, offsets, points) written by export_points()"""
+    with open(prefix+'_images.txt', 'r') as filehandle:
+        image_filenames = filehandle.read().splitlines()
+    offsets = numpy.load(prefix+'_offsets.npy')
+    points = numpy.load(prefix+'.npy', mmap_mode='r')
+    return image_filenames, offsets, points
+
+###############################################################################
+
+# annotation store of a batch worker process, see init_batch_worker()
+BATCH_STORE = None
+
+def init_batch_worker(db_filename, path):
+    """Set up a batch worker process, which has its own annotation store"""
+    global BATCH_STORE #pylint: disable=global-statement
+    if db_filename is not None:
+        BATCH_STORE = SqliteStore(db_filename, path)
+    else:
+        BATCH_STORE = PtsFileStore()
+
+def find_pts_file_problems(pts_filename):
+    """Returns list of descriptions of malformed lines in a .pts file"""
+    with open(pts_filename, 'r') as filehandle:
+        lines = filehandle.readlines()
+    problems = []
+    for line_number, line in enumerate(lines, 1):
+        pair = line.split(',')
+        if len(pair) != 2:
+            problems.append('line %d: expected 2 comma-separated numbers, '
+                            'got %r' % (line_number, line.rstrip('\n')))
+            continue
+        try:
+            float(pair[0])
+            float(pair[1])
+        except ValueError:
+            problems.append('line %d: not a number in %r' %
+                            (line_number, line.rstrip('\n')))
+    return problems
+
+def find_point_problems(points, image_size):
+    """Returns list of descriptions of points that are not in the image"""
+    if len(points) == 0:
+        return ['no points']
+    width, height = image_size
+    problems = []
+    for i, (x_coord, y_coord) in enumerate(points):
+        if not (0 <= x_coord < width and 0 <= y_coord < height):
+            problems.append('point %d (%s, %s) is outside the %dx%d image' %
+                            (i+1, x_coord, y_coord, width, height))
+    return problems
+
+def run_batch_task(task):
+    """
+    Process one image in a batch worker process.  Returns (image filename,
+    list of problems found, whether the points were changed, points) -
+    where points are None unless the caller has to save them.
+    """
+    command, image_filename, image_size, target = task
+    if command == 'validate' and isinstance(BATCH_STORE, PtsFileStore):
+        # catch what the (lenient) .pts reader would silently accept
+        problems = find_pts_file_problems(find_pts_file(image_filename))
+        if problems:
+            return image_filename, problems, False, None
+    try:
+        points = BATCH_STORE.read_points(image_filename)
+    except (IOError, ValueError, IndexError) as error:
+        return (image_filename, ['cannot read points: %s' % error], False,
+                None)
+
+    if command == 'validate':
+        return (image_filename, find_point_problems(points, image_size),
+                False, None)
+    if command == 'reorder':
+        if sort_face_points(points):
+            BATCH_STORE.write_points(image_filename, points)
+            return image_filename, [], True, None
+        return image_filename, [], False, None
+    # command == 'convert'
+    if target == 'pts':
+        PtsFileStore().write_points(image_filename, points)
+        return image_filename, [], True, None
+    return image_filename, [], True, points
+
+def write_csv_points(output_filename, items, path):
+    """Write (image filename, points) pairs to a CSV file, a row per point"""
+    with open(output_filename, 'w', newline='') as filehandle:
+        writer = csv.writer(filehandle)
+        writer.writerow(['image', 'point', 'x', 'y'])
+        for image_filename, points in items:
+            image_key = os.path.relpath(image_filename, path)
+            for i, (x_coord, y_coord) in enumerate(points):
+                writer.writerow([image_key, i, x_coord, y_coord])
+
+def batch_main(argv):
+    """Runs a batch command over a directory tree, without the GUI"""
+    parser = argparse.ArgumentParser(
+        prog='%s batch' % os.path.basename(sys.argv[0]),
+        description='Process all tagged images in a directory tree, in '
+        'parallel, without bringing up the GUI.')
+    parser.add_argument('command', choices=['reorder', 'validate', 'convert'],
+                        help='reorder: sort 3-point face annotations into '
+                        'right eye, left eye, mouth order; validate: report '
+                        'malformed annotations and points outside their '
+                        'image; convert: copy annotations to another format')
+    parser.add_argument('directory', help='directory to search for images')
+    parser.add_argument('--db', metavar='FILE', help='read (and, for '
+                        'reorder, save) points in this SQLite file instead '
+                        'of in .pts files')
+    parser.add_argument('--to', choices=['pts', 'db', 'csv'],
+                        help='convert: format to convert to - .pts files, '
+                        'a SQLite file or a CSV file')
+    parser.add_argument('--output', metavar='FILE',
+                        help='convert: SQLite or CSV file to write')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        metavar='N', help='number of worker processes '
+                        '(default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.command == 'convert':
+        if args.to is None:
+            parser.error('convert needs --to')
+        if args.to != 'pts' and args.output is None:
+            parser.error('converting to %s needs --output' % args.to)
+        if args.to == 'pts' and args.db is None:
+            parser.error('points are already in .pts files, use --db to '
+                         'convert from a SQLite file')
+
+    path = args.directory
+    if not os.path.isdir(path):
+        print('\tError: directory %s does not exist.  Exiting...' % path)
+        raise SystemExit(-1)
+
+    image_filenames, manifest = scan_image_files(path)
+    if args.db is not None:
+        store = SqliteStore(args.db, path)
+    else:
+        store = PtsFileStore(manifest)
+    labeled = store.find_labeled(image_filenames)
+    store.close()
+
+    tasks = [(args.command, image_filename,
+              manifest.get_image_size(image_filename), args.to)
+             for image_filename in image_filenames
+             if image_filename in labeled]
+    num_problems = 0
+    num_changed = 0
+    converted = []
+    with ProcessPoolExecutor(max_workers=args.jobs,
+                             initializer=init_batch_worker,
+                             initargs=(args.db, path)) as executor:
+        for image_filename, problems, changed, points in executor.map(
+                run_batch_task, tasks, chunksize=BATCH_CHUNKSIZE):
+            for problem in problems:
+                print('%s: %s' % (image_filename, problem))
+            num_problems += len(problems)
+            num_changed += changed
+            if points is not None:
+                converted.append((image_filename, points))
+
+    if args.command == 'validate':
+        print('%d images checked, %d problems found' %
+              (len(tasks), num_problems))
+    elif args.command == 'reorder':
+        print('%d images checked, %d reordered' % (len(tasks), num_changed))
+    else:
+        if args.to == 'db':
+            output_store = SqliteStore(args.output, path)
+            output_store.write_many(converted)
+            output_store.close()
+        elif args.to == 'csv':
+            write_csv_points(args.output, converted, path)
+        print('%d images converted' % num_changed)
+    if num_problems > 0:
+        raise SystemExit(1)
+
 ###############################################################################
 
 def main():
     """Function that runs when this script is called from the commandline"""
-    progname = sys.argv[0]
-    usage_message = '\n\tUsage: %s <directory>\n\n' % progname
-
-    num_args = len(sys.argv)-1
-    if num_args == 0 or num_args > 1:
-        print(usage_message)
-        print('\t%s finds images recursively in given directory ' % progname)
-        print('\tand brings up a GUI for marking points in each image. The\n'+\
-              '\tmarked points are saved to a file with the same name as\n'+\
-              '\tthe image file, but with a .pts extension.\n')
+    if sys.argv[1:2] == ['batch']:
+        batch_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s [options] <directory>',
+        description='%(prog)s finds images recursively in given directory '
+        'and brings up a GUI for marking points in each image. The marked '
+        'points are saved to a file with the same name as the image file, '
+        'but with a .pts extension.',
+        epilog='Run "%(prog)s batch --help" to reorder, validate or convert '
+        'the points of a whole directory tree without the GUI.')
+    parser.add_argument('directory', help='directory to search for images')
+    parser.add_argument('--prefetch', type=int, default=NUM_PREFETCH,
+                        metavar='N', help='number of images before and after '
+                        'the current one to prepare in the background '
+                        '(default: %(default)s)')
+    parser.add_argument('--cache-mb', type=int, default=CACHE_MEGABYTES,
+                        metavar='MB', help='memory budget for prepared '
+                        'images, in megabytes (default: %(default)s)')
+    parser.add_argument('--decode-mb', type=int, default=DECODE_MEGABYTES,
+                        metavar='MB', help='memory budget for decoding one '
+                        'image, larger images are decoded at reduced '
+                        'resolution where their format allows it, in '
+                        'megabytes (default: %(default)s)')
+    parser.add_argument('--disk-cache-mb', type=int,
+                        default=DISK_CACHE_MEGABYTES, metavar='MB',
+                        help='disk budget for prepared images kept across '
+                        'sessions in %s, in megabytes, 0 to keep none '
+                        '(default: %%(default)s)' % get_cache_dirname())
+    parser.add_argument('--db', metavar='FILE', help='keep points of all '
+                        'images in this SQLite file instead of in .pts files')
+    parser.add_argument('--profile', metavar='FILE', help='time selecting, '
+                        'resizing, redrawing, clicking and saving, show the '
+                        'latencies in a status line and write them to FILE '
+                        '(JSON) on exit')
+    parser.add_argument('--propagate', action='store_true', help='predict '
+                        'the points of each unlabeled image from those of the '
+                        'image shown before it, by template matching (e.g. '
+                        'for video frames), press "a" to accept them')
+    parser.add_argument('--export', metavar='PREFIX', help='do not bring up '
+                        'the GUI, write all points to PREFIX.npy, with an '
+                        'index in PREFIX_offsets.npy and PREFIX_images.txt')
+
+    if len(sys.argv) == 1:
+        parser.print_help()
         raise SystemExit(-1)
+    args = parser.parse_args()
 
-    path = sys.argv[1]
+    path = args.directory
     if not os.path.isdir(path):
         print('\tError: directory %s does not exist.  Exiting...' % path)
         raise SystemExit(-1)
 
+    if args.db is not None:
+        store = SqliteStore(args.db, path)
+    else:
+        store = None
+
+    if args.export is not None:
+        image_filenames, manifest = scan_image_files(path)
+        if store is None:
+            store = PtsFileStore(manifest)
+        export_points(store, image_filenames, path, args.export)
+        store.close()
+        return
+
     print('\nINSTRUCTIONS:')
     print('-------------')
     print('Anywhere in the appliations:')
     print('\t<Down Arrow>  - go to next image')
     print('\t<Up Arrow>    - go to previous image')
+    print('\t<Enter>       - go to next unlabeled image claimed for you')
+    print('\t<a>           - accept predicted points (with --propagate)')
+    print('\t<+> / <->     - zoom in or out')
+    print('\t<0>           - show the whole image')
     print('\t<Alt-F4>      - quit')
     print('When the mouse is over displayed image:')
     print('\t<Left Mouse>  - add a point')
     print('\t<Right Mouse> - remove a point')
+    print('\t<Mouse wheel> - zoom in or out')
+    print('\t<Middle Mouse> - drag to pan a zoomed-in image')
     print('When the mouse is over the list of image filenames:')
     print('\t<Mouse wheel> - move through image list')
     print('\t<Left Mouse>  - select image to work on')
-    print('\nNB: tagging is more accurate when this tool is maximized\n')
-    print('OUTPUT: For each tagged image, a text file with the same name')
-    print('        as the original image filename (but with a .pts extension)')
-    print('        is saved at the same location as the image.')
-
-    Application(sys.argv[1]).mainloop()
+    print('\nNB: tagging is more accurate when zoomed in\n')
+    if args.db is not None:
+        print('OUTPUT: The points of all tagged images are saved to the')
+        print('        SQLite database %s' % args.db)
+    else:
+        print('OUTPUT: For each tagged image, a text file with the same name')
+        print('        as the original image filename (but with a .pts '
+              'extension)')
+        print('        is saved at the same location as the image.')
+
+    app = Application(path, num_prefetch=args.prefetch,
+                      cache_megabytes=args.cache_mb,
+                      decode_megabytes=args.decode_mb, store=store,
+                      profiler=LatencyProfiler(enabled=args.profile
+                                               is not None),
+                      propagate=args.propagate,
+                      disk_cache_megabytes=args.disk_cache_mb)
+    try:
+        app.mainloop()
+    finally:
+        # flush points and release claims even on Ctrl-C
+        app.shutdown()
+        if args.profile is not None:
+            app.profiler.save_report(args.profile)
 
 ###############################################################################
 
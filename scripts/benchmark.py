@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+"""benchmark.py - headless benchmarks of ptagtool.py's hot paths"""
+
+# Generates a synthetic image corpus (or uses an existing directory) and
+# times, without bringing up the GUI, the work that ptagtool.py does when
+# scanning a dataset, loading and scaling an image for display,
+# transforming, looking up and predicting points, and reading and saving
+# points.
+#
+# Examples:
+#   ./scripts/benchmark.py --images 2000 --size 4000x3000 --format jpg
+#   ./scripts/benchmark.py --save-baseline baseline.json
+#   ./scripts/benchmark.py --baseline baseline.json
+
+import sys
+import os
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+
+# ptagtool.py lives in the project's root folder, one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+#pylint: disable=wrong-import-position
+import numpy
+import PIL.Image
+import ptagtool
+
+# fraction of generated images that get a .pts file
+LABELED_FRACTION = 0.5
+
+# number of points in each generated .pts file
+POINTS_PER_IMAGE = 3
+
+# canvas size that images are scaled to fit, as in a maximized window
+CANVAS_SIZE = (1600, 1000)
+
+# a benchmark is a regression if its median latency is slower than the
+# baseline's by more than this fraction
+DEFAULT_TOLERANCE = 0.2
+
+def parse_size(text):
+    """Returns (width, height) parsed from a WIDTHxHEIGHT string"""
+    try:
+        width, height = text.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected WIDTHxHEIGHT, got %r' %
+                                         text)
+
+def make_corpus(path, num_images, image_size, image_format, num_dirs):
+    """Fill directory 'path' with synthetic images, .pts and other files"""
+    rng = random.Random(0)
+    # one random-ish image is saved once, then copied, so that generating a
+    # large corpus does not take longer than benchmarking it
+    template = os.path.join(path, 'template.'+image_format)
+    noise = numpy.random.RandomState(0).randint(
+        0, 256, (image_size[1]//8+1, image_size[0]//8+1, 3), numpy.uint8)
+    PIL.Image.fromarray(noise).resize(image_size, PIL.Image.BILINEAR).save(
+        template)
+    for i in range(num_images):
+        folder = os.path.join(path, 'dir%03d' % (i % num_dirs))
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+            # every folder also has some files that are not images
+            with open(os.path.join(folder, 'README.txt'), 'w') as filehandle:
+                filehandle.write('not an image\n')
+        image_filename = os.path.join(folder, 'image%07d.%s' %
+                                      (i, image_format))
+        shutil.copyfile(template, image_filename)
+        if rng.random() < LABELED_FRACTION:
+            with open(ptagtool.get_pts_filename(image_filename),
+                      'w') as filehandle:
+                for _ in range(POINTS_PER_IMAGE):
+                    filehandle.write('%s, %s\n' %
+                                     (rng.uniform(0, image_size[0]),
+                                      rng.uniform(0, image_size[1])))
+    os.remove(template)
+
+def time_calls(function, args_list):
+    """Returns list of seconds taken by function(*args) for each args"""
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter()-start)
+    return latencies
+
+def summarize(latencies, items_per_call=1):
+    """Returns dict with throughput and latency percentiles of timings"""
+    latencies = numpy.array(latencies)
+    total = latencies.sum()
+    p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+    return {'calls': len(latencies),
+            'per_second': items_per_call*len(latencies)/total
+                          if total > 0 else float('inf'),
+            'p50_ms': 1000.0*p50,
+            'p90_ms': 1000.0*p90,
+            'p99_ms': 1000.0*p99}
+
+def bench_scan(path, scratch_dir, repeat):
+    """Time a full scan, a scan with a fresh manifest and a re-scan"""
+    results = {}
+    num_images = len(ptagtool.find_image_files(path))
+    results['scan.walk'] = summarize(
+        time_calls(ptagtool.find_image_files, [(path,)]*repeat), num_images)
+
+    # the manifest is kept in the scratch folder, never in the dataset's
+    # own .ptagtool folder, which other annotators may be using
+    manifest_filename = os.path.join(scratch_dir, ptagtool.MANIFEST_FILENAME)
+
+    def scan():
+        """Scan with the manifest in the scratch folder, if any"""
+        manifest = ptagtool.ImageManifest(path)
+        manifest.filename = manifest_filename
+        manifest.load()
+        manifest.scan()
+        manifest.save()
+
+    def scan_cold():
+        """Scan without a manifest"""
+        if os.path.exists(manifest_filename):
+            os.remove(manifest_filename)
+        scan()
+
+    results['scan.manifest_cold'] = summarize(
+        time_calls(scan_cold, [()]*repeat), num_images)
+    # directories modified just now are not trusted by the manifest
+    time.sleep(ptagtool.MANIFEST_MTIME_SLACK)
+    scan()
+    results['scan.manifest_warm'] = summarize(
+        time_calls(scan, [()]*repeat), num_images)
+    return results
+
+def bench_load(image_filenames, max_images):
+    """Time decoding and scaling images to fit the canvas, and reading
+    them back from the disk cache"""
+    args_list = [(image_filename, CANVAS_SIZE)
+                 for image_filename in image_filenames[:max_images]]
+    results = {'load.scaled': summarize(
+        time_calls(ptagtool.load_scaled_image, args_list))}
+    cache_dirname = tempfile.mkdtemp(prefix='ptagtool-cache-')
+    disk_cache = ptagtool.DiskCache(cache_dirname, 1 << 40)
+    for image_filename, canvas_size in args_list:
+        disk_cache.put(image_filename, canvas_size,
+                       *ptagtool.load_scaled_image(image_filename,
+                                                   canvas_size))
+    results['load.disk_cache'] = summarize(time_calls(disk_cache.get,
+                                                      args_list))
+    shutil.rmtree(cache_dirname)
+    return results
+
+def get_image_size(image_filename):
+    """Returns original size of image, which may be a frame of a
+    multi-frame file"""
+    image, image_size = ptagtool.open_image(image_filename, CANVAS_SIZE)
+    image.close()
+    return image_size
+
+def bench_render(image_filenames, max_images, num_points):
+    """Time the display geometry and point transforms of each resize"""
+    rng = numpy.random.RandomState(0)
+    image_sizes = [get_image_size(image_filename)
+                   for image_filename in image_filenames[:max_images]]
+    points = rng.uniform(0, 1000, (num_points, 2))
+
+    def layout(image_size):
+        """Fit image in canvas, then place points, as on_resize_canvas()"""
+        display_size = ptagtool.fit_image_size(image_size, CANVAS_SIZE)
+        x_offset, y_offset, scaling = ptagtool.get_display_geometry(
+            image_size, display_size, CANVAS_SIZE)
+        ptagtool.transform_points(points, scaling, x_offset, y_offset)
+
+    return {'render.layout': summarize(
+        time_calls(layout, [(image_size,) for image_size in image_sizes]))}
+
+def bench_zoom(image_filename, zoom, repeat):
+    """Time showing random parts of a zoomed-in image, as when panning"""
+    rng = numpy.random.RandomState(0)
+    start = time.perf_counter()
+    pyramid = ptagtool.ImagePyramid(image_filename)
+    results = {'zoom.decode': summarize([time.perf_counter()-start])}
+    image_size = pyramid.image_size
+    scaling = zoom*ptagtool.get_display_geometry(
+        image_size, ptagtool.fit_image_size(image_size, CANVAS_SIZE),
+        CANVAS_SIZE)[2]
+
+    def render(origin):
+        """Crop and scale the part in view, as render_view()"""
+        origin = ptagtool.clamp_view_origin(image_size, CANVAS_SIZE, scaling,
+                                            origin)
+        box, display_size, _ = ptagtool.get_viewport(image_size, CANVAS_SIZE,
+                                                     scaling, origin)
+        pyramid.render(scaling, box, display_size)
+
+    origins = [(tuple(origin),) for origin in
+               rng.uniform(0, 1, (repeat, 2))*image_size]
+    results['zoom.render'] = summarize(time_calls(render, origins))
+    return results
+
+def bench_points(num_points, repeat):
+    """Time point transforms and nearest-point lookups"""
+    rng = numpy.random.RandomState(0)
+    points = rng.uniform(0, 4000, (num_points, 2))
+    results = {}
+    results['points.transform'] = summarize(
+        time_calls(ptagtool.transform_points,
+                   [(points, 0.25, 10.0, 20.0)]*repeat), num_points)
+
+    queries = [tuple(query) for query in rng.uniform(0, 4000, (repeat, 2))]
+    results['points.find'] = summarize(
+        time_calls(lambda x, y: ptagtool.find_nearest_point(points, x, y,
+                                                            20.0), queries))
+    return results
+
+def bench_propagate(num_points, repeat):
+    """Time predicting points of a frame from those of the one before"""
+    rng = numpy.random.RandomState(0)
+    noise = rng.uniform(0, 255, (CANVAS_SIZE[1]//8, CANVAS_SIZE[0]//8))
+    image = numpy.asarray(PIL.Image.fromarray(noise.astype(numpy.float32))
+                          .resize(CANVAS_SIZE, PIL.Image.BICUBIC))
+    next_image = numpy.roll(image, (2, 3), axis=(0, 1))
+    points = rng.uniform(50, min(CANVAS_SIZE)-50, (num_points, 2))
+    return {'points.propagate': summarize(
+        time_calls(ptagtool.match_points,
+                   [(image, next_image, points)]*repeat), num_points)}
+
+def bench_store(name, store, scratch_dir, max_images):
+    """Time saving and reading points through an annotation store, for
+    images (that need not exist) in the scratch folder"""
+    rng = numpy.random.RandomState(0)
+    image_filenames = [os.path.join(scratch_dir, 'image%06d.jpg' % i)
+                       for i in range(max_images)]
+    points = [rng.uniform(0, 1000, (POINTS_PER_IMAGE, 2)).tolist()
+              for _ in image_filenames]
+    results = {}
+    results['%s.save' % name] = summarize(
+        time_calls(store.write_points, list(zip(image_filenames, points))))
+    results['%s.read' % name] = summarize(
+        time_calls(store.read_points, [(image_filename,)
+                                       for image_filename in image_filenames]))
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print comparison with baseline results, returns # of regressions"""
+    num_regressions = 0
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['p50_ms']
+        new = results[name]['p50_ms']
+        change = (new-old)/old if old > 0 else 0.0
+        regressed = change > tolerance
+        num_regressions += regressed
+        print('%-26s %10.3f -> %10.3f ms  %+7.1f%%%s' %
+              (name, old, new, 100.0*change,
+               '  REGRESSION' if regressed else ''))
+    return num_regressions
+
+def main():
+    """Function that runs when this script is called from the commandline"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scan, load, render and save hot paths of '
+        'ptagtool.py without a display.')
+    parser.add_argument('--corpus', metavar='DIR', help='benchmark this '
+                        'directory (it is only read) instead of a '
+                        'generated one')
+    parser.add_argument('--scratch', metavar='DIR', help='write manifests '
+                        'and points in a temporary folder inside DIR - '
+                        'e.g. on the same file system as the corpus '
+                        '(default: the system\'s temporary folder)')
+    parser.add_argument('--images', type=int, default=500, metavar='N',
+                        help='number of images to generate (default: '
+                        '%(default)s)')
+    parser.add_argument('--size', type=parse_size, default=(3000, 2000),
+                        metavar='WxH', help='size of generated images '
+                        '(default: 3000x2000)')
+    parser.add_argument('--format', default='jpg',
+                        choices=['jpg', 'png', 'tif', 'bmp'],
+                        help='format of generated images (default: '
+                        '%(default)s)')
+    parser.add_argument('--dirs', type=int, default=10, metavar='N',
+                        help='number of folders to spread generated images '
+                        'over (default: %(default)s)')
+    parser.add_argument('--points', type=int, default=2000, metavar='N',
+                        help='number of points for the point benchmarks '
+                        '(default: %(default)s)')
+    parser.add_argument('--landmarks', type=int, default=68, metavar='N',
+                        help='number of points per image for the point '
+                        'propagation benchmark (default: %(default)s)')
+    parser.add_argument('--zoom', type=float, default=4.0, metavar='F',
+                        help='magnification for the zoom benchmarks '
+                        '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, metavar='N',
+                        help='number of times to repeat whole-corpus '
+                        'benchmarks (default: %(default)s)')
+    parser.add_argument('--max-images', type=int, default=100, metavar='N',
+                        help='number of images for per-image benchmarks '
+                        '(default: %(default)s)')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='save results to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='compare results '
+                        'with FILE, exit with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        metavar='F', help='median latency slowdown, as a '
+                        'fraction, that counts as a regression (default: '
+                        '%(default)s)')
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.corpus is not None:
+        path = args.corpus
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='ptagtool-bench-')
+        path = tmp_dir
+        print('generating %d %dx%d %s images in %s' %
+              (args.images, args.size[0], args.size[1], args.format, path))
+        make_corpus(path, args.images, args.size, args.format, args.dirs)
+
+    scratch_dir = tempfile.mkdtemp(prefix='ptagtool-scratch-',
+                                   dir=args.scratch)
+    try:
+        results = {}
+        results.update(bench_scan(path, scratch_dir, args.repeat))
+        image_filenames = ptagtool.find_image_files(path)
+        results.update(bench_load(image_filenames, args.max_images))
+        results.update(bench_render(image_filenames, args.max_images,
+                                    args.points))
+        results.update(bench_zoom(image_filenames[0], args.zoom,
+                                  10*args.repeat))
+        results.update(bench_points(args.points, 100*args.repeat))
+        results.update(bench_propagate(args.landmarks, 10*args.repeat))
+        results.update(bench_store('pts', ptagtool.PtsFileStore(),
+                                   scratch_dir, args.max_images))
+        store = ptagtool.SqliteStore(os.path.join(scratch_dir,
+                                                  'points.sqlite'),
+                                     scratch_dir)
+        results.update(bench_store('sqlite', store, scratch_dir,
+                                   args.max_images))
+        store.close()
+    finally:
+        shutil.rmtree(scratch_dir)
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    print('%-26s %8s %12s %10s %10s %10s' %
+          ('benchmark', 'calls', 'items/s', 'p50 ms', 'p90 ms', 'p99 ms'))
+    for name in sorted(results):
+        result = results[name]
+        print('%-26s %8d %12.1f %10.3f %10.3f %10.3f' %
+              (name, result['calls'], result['per_second'],
+               result['p50_ms'], result['p90_ms'], result['p99_ms']))
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as filehandle:
+            json.dump(results, filehandle, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as filehandle:
+            baseline = json.load(filehandle)
+        print('\ncomparison with %s:' % args.baseline)
+        if compare(results, baseline, args.tolerance) > 0:
+            raise SystemExit(1)
+
+###############################################################################
+
+if __name__ == '__main__':
+    main()
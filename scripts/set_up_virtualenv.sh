@@ -27,7 +27,7 @@ if [ ! -d "env" ]; then
 
     # wheel is required otherwise there's a dependency issue
     # (e.g. see stackoverflow.com/questions/34819221)
-    pip3 install pillow
+    pip3 install pillow numpy
 
     # make a new one every time
     pip3 freeze > requirements.txt
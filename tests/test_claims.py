@@ -0,0 +1,123 @@
+"""Tests of the work-claiming queue of concurrent annotators"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import ptagtool
+
+def make_queue(path, name, timeout=ptagtool.CLAIM_TIMEOUT):
+    """Returns claim queue of an annotator on another host"""
+    claims = ptagtool.ClaimQueue(str(path), timeout=timeout)
+    claims.owner = '%s@otherhost:1' % name
+    return claims
+
+def get_claim_path(claims, image_filename):
+    """Returns path of the claim file of image"""
+    return os.path.join(claims.dirname,
+                        claims.get_claim_filename(image_filename))
+
+def test_claimed_image_is_not_handed_out_twice(tmp_path):
+    """A second annotator sees the first one's claim"""
+    image_filename = str(tmp_path/'a.jpg')
+    first = make_queue(tmp_path, 'first')
+    second = make_queue(tmp_path, 'second')
+    assert first.claim(image_filename) == first.owner
+    assert second.claim(image_filename) == first.owner
+    assert first.claim(image_filename) == first.owner
+    second.find_others()
+    assert second.is_claimed_by_other(image_filename)
+    first.find_others()
+    assert not first.is_claimed_by_other(image_filename)
+
+def test_released_image_can_be_claimed(tmp_path):
+    """Releasing a claim hands the image to the next annotator"""
+    image_filename = str(tmp_path/'a.jpg')
+    first = make_queue(tmp_path, 'first')
+    second = make_queue(tmp_path, 'second')
+    first.claim(image_filename)
+    first.release(image_filename)
+    assert not os.path.exists(get_claim_path(first, image_filename))
+    assert second.claim(image_filename) == second.owner
+
+def test_idle_claim_expires(tmp_path):
+    """Claims not renewed within the timeout are taken over"""
+    image_filename = str(tmp_path/'a.jpg')
+    first = make_queue(tmp_path, 'first', timeout=60)
+    second = make_queue(tmp_path, 'second', timeout=60)
+    first.claim(image_filename)
+    claim_path = get_claim_path(first, image_filename)
+    mtime = time.time()-120
+    os.utime(claim_path, (mtime, mtime))
+    second.find_others()
+    assert not second.is_claimed_by_other(image_filename)
+    assert second.claim(image_filename) == second.owner
+    with open(claim_path, 'r') as filehandle:
+        assert filehandle.read() == second.owner
+    # the first annotator notices that it lost the claim when renewing
+    first.renew([image_filename])
+    assert image_filename not in first.held
+
+def test_renewed_claim_does_not_expire(tmp_path):
+    """Renewing a claim keeps it from lapsing"""
+    image_filename = str(tmp_path/'a.jpg')
+    first = make_queue(tmp_path, 'first', timeout=60)
+    second = make_queue(tmp_path, 'second', timeout=60)
+    first.claim(image_filename)
+    claim_path = get_claim_path(first, image_filename)
+    mtime = time.time()-50
+    os.utime(claim_path, (mtime, mtime))
+    first.renew([image_filename])
+    assert time.time()-os.stat(claim_path).st_mtime < 10
+    assert second.claim(image_filename) == first.owner
+
+def test_claim_of_dead_process_lapses(tmp_path):
+    """Claims of processes that are gone, on this host, are taken over"""
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    image_filename = str(tmp_path/'a.jpg')
+    dead = ptagtool.ClaimQueue(str(tmp_path))
+    dead.owner = 'someone@%s:%d' % (dead.hostname, process.pid)
+    dead.claim(image_filename)
+    alive = make_queue(tmp_path, 'alive')
+    alive.hostname = dead.hostname
+    assert alive.claim(image_filename) == alive.owner
+
+def test_contention_has_a_single_winner(tmp_path):
+    """Of annotators claiming the same image at once, exactly one wins"""
+    for i in range(20):
+        image_filename = str(tmp_path/('%d.jpg' % i))
+        queues = [make_queue(tmp_path, 'annotator%d' % j) for j in range(8)]
+        owners = [None]*len(queues)
+        barrier = threading.Barrier(len(queues))
+
+        def claim(j, claims=queues, image_filename=image_filename,
+                  owners=owners, barrier=barrier):
+            """Claim image as annotator j"""
+            barrier.wait()
+            owners[j] = claims[j].claim(image_filename)
+
+        threads = [threading.Thread(target=claim, args=(j,))
+                   for j in range(len(queues))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        winners = [claims for claims, owner in zip(queues, owners)
+                   if owner == claims.owner]
+        assert len(winners) == 1
+        # losers may find the winner's claim file before its owner is
+        # written into it, but never take it for their own
+        with open(get_claim_path(winners[0], image_filename), 'r') as \
+             filehandle:
+            assert filehandle.read() == winners[0].owner
+
+def test_read_only_folder_gives_up(tmp_path):
+    """If claim files cannot be written, every image counts as claimed"""
+    claims = make_queue(tmp_path, 'first')
+    claims.dirname = str(tmp_path/'file'/'claims')
+    (tmp_path/'file').write_text('not a folder')
+    assert claims.claim(str(tmp_path/'a.jpg')) == claims.owner
+    assert not claims.writable
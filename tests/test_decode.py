@@ -0,0 +1,46 @@
+"""Tests of decoding images at reduced resolution"""
+
+import numpy
+import PIL.features
+import PIL.Image
+import pytest
+
+import ptagtool
+
+def make_image(filename, size):
+    """Write a noisy RGB image"""
+    pixels = numpy.random.RandomState(0).randint(
+        0, 256, (size[1], size[0], 3)).astype(numpy.uint8)
+    PIL.Image.fromarray(pixels).save(filename)
+
+@pytest.mark.skipif(not PIL.features.check('jpg_2000'),
+                    reason='Pillow built without JPEG 2000 support')
+def test_reduced_jpeg2000(tmp_path):
+    """JPEG 2000 images decoded with wavelet levels dropped are scaled to
+    the canvas, relative to their original size"""
+    filename = str(tmp_path/'image.jp2')
+    make_image(filename, (1600, 1200))
+    with PIL.Image.open(filename) as image:
+        ptagtool.reduce_on_decode(image, (200, 150), 256*1024*1024)
+        assert image.reduce > 0
+    image, image_size = ptagtool.load_scaled_image(filename, (200, 150))
+    assert image.size == (200, 150)
+    assert image_size == (1600, 1200)
+
+def test_reduced_jpeg(tmp_path):
+    """JPEG images are decoded in draft mode, scaled relative to their
+    original size"""
+    filename = str(tmp_path/'image.jpg')
+    make_image(filename, (1600, 1200))
+    image, image_size = ptagtool.load_scaled_image(filename, (200, 150))
+    assert image.size == (200, 150)
+    assert image_size == (1600, 1200)
+
+def test_decode_budget(tmp_path):
+    """Images that would not fit the decode budget are decoded smaller"""
+    filename = str(tmp_path/'image.jpg')
+    make_image(filename, (1600, 1200))
+    with PIL.Image.open(filename) as image:
+        ptagtool.reduce_on_decode(image, (1600, 1200), 1600*1200)
+        image.load()
+        assert image.size[0]*image.size[1]*3 <= 1600*1200
@@ -0,0 +1,35 @@
+"""Tests of the disk cache of images scaled for display"""
+
+import numpy
+import PIL.Image
+import pytest
+
+import ptagtool
+
+@pytest.mark.parametrize('mode', ['RGB', 'L', 'RGBA', 'P', 'F', 'I',
+                                  'I;16', 'CMYK'])
+def test_image_is_cached_in_any_mode(tmp_path, mode):
+    """Images of modes PNG cannot hold are cached in their base mode"""
+    image_filename = str(tmp_path/'image.tif')
+    rng = numpy.random.RandomState(0)
+    PIL.Image.fromarray(rng.randint(0, 256, (48, 64, 3))
+                        .astype(numpy.uint8)).save(image_filename)
+    image = PIL.Image.new(mode, (32, 24))
+    disk_cache = ptagtool.DiskCache(str(tmp_path/'cache'), 1 << 20)
+    disk_cache.put(image_filename, (320, 240), image, (64, 48))
+    cached = disk_cache.get(image_filename, (320, 240))
+    assert cached is not None
+    assert cached[0].size == (32, 24)
+    assert cached[0].mode in ('RGB', 'L', 'RGBA', 'P')
+    assert cached[1] == (64, 48)
+
+def test_unwritable_cache_is_skipped(tmp_path, capsys):
+    """Failing to write the cache only warns"""
+    image_filename = str(tmp_path/'image.png')
+    PIL.Image.new('RGB', (64, 48)).save(image_filename)
+    (tmp_path/'cache').write_text('')
+    disk_cache = ptagtool.DiskCache(str(tmp_path/'cache'), 1 << 20)
+    disk_cache.put(image_filename, (320, 240), PIL.Image.new('RGB', (32, 24)),
+                   (64, 48))
+    assert 'cannot write to disk cache' in capsys.readouterr().out
+    assert disk_cache.get(image_filename, (320, 240)) is None
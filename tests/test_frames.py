@@ -0,0 +1,217 @@
+"""Tests of multi-frame TIFF and GIF files"""
+
+import threading
+
+import numpy
+import PIL.Image
+import pytest
+from PIL import TiffImagePlugin
+
+import ptagtool
+
+def make_frames(num_frames, size=(64, 48)):
+    """Returns list of distinct RGB images"""
+    rng = numpy.random.RandomState(0)
+    return [PIL.Image.fromarray(rng.randint(0, 256, (size[1], size[0], 3))
+                                .astype(numpy.uint8))
+            for _ in range(num_frames)]
+
+def write_tiff(filename, pages):
+    """Write TIFF of (image, reduced-resolution flag) pages"""
+    with TiffImagePlugin.AppendingTiffWriter(filename, True) as tiff:
+        for image, reduced in pages:
+            image.save(tiff, tiffinfo={254: 1 if reduced else 0})
+            tiff.newFrame()
+
+def test_frames_are_listed(tmp_path):
+    """Each frame is an image, reduced-resolution pages are not"""
+    frames = make_frames(3)
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(frames[0], False), (frames[0].resize((16, 12)), True),
+                (frames[1], False), (frames[2], False)])
+    write_tiff(str(tmp_path/'pyramid.tif'),
+               [(frames[0], False), (frames[0].resize((32, 24)), True)])
+    gif = [frame.convert('P') for frame in frames]
+    gif[0].save(str(tmp_path/'anim.gif'), save_all=True,
+                append_images=gif[1:])
+    expected = [str(tmp_path/'anim.gif[000000]'),
+                str(tmp_path/'anim.gif[000001]'),
+                str(tmp_path/'anim.gif[000002]'),
+                str(tmp_path/'pyramid.tif'),
+                str(tmp_path/'stack.tif[000000]'),
+                str(tmp_path/'stack.tif[000002]'),
+                str(tmp_path/'stack.tif[000003]')]
+    assert ptagtool.find_image_files(str(tmp_path)) == expected
+    assert ptagtool.scan_image_files(str(tmp_path))[0] == expected
+
+def test_frame_is_decoded(tmp_path):
+    """A frame decodes to that page's pixels"""
+    frames = make_frames(4)
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(frame, False) for frame in frames])
+    for page in [3, 1, 2, 0]:
+        image, image_size = ptagtool.open_image(
+            str(tmp_path/('stack.tif[%06d]' % page)))
+        assert image_size == (64, 48)
+        assert numpy.array_equal(numpy.asarray(image),
+                                 numpy.asarray(frames[page]))
+    with pytest.raises(IOError):
+        ptagtool.open_image(str(tmp_path/'stack.tif[000009]'))
+
+def test_frame_is_decoded_from_reduced_page(tmp_path):
+    """A frame with a reduced-resolution page after it is decoded from
+    that page, if it is large enough"""
+    frames = make_frames(2, (400, 300))
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(frames[0], False), (frames[0].resize((100, 75)), True),
+                (frames[1], False), (frames[1].resize((100, 75)), True)])
+    image, image_size = ptagtool.load_scaled_image(
+        str(tmp_path/'stack.tif[000002]'), (80, 60))
+    assert image.size == (80, 60)
+    assert image_size == (400, 300)
+    image, image_size = ptagtool.open_image(
+        str(tmp_path/'stack.tif[000002]'), (80, 60))
+    assert image.size == (100, 75)
+    # a canvas larger than the reduced page needs the full page
+    image, image_size = ptagtool.open_image(
+        str(tmp_path/'stack.tif[000002]'), (200, 150))
+    assert image.size == (400, 300)
+
+def test_frames_load_concurrently(tmp_path):
+    """Threads decoding frames of several files, more than are kept open,
+    all get the right pixels"""
+    frames = make_frames(4)
+    filenames = []
+    for i in range(4):
+        filenames.append(str(tmp_path/('stack%d.tif' % i)))
+        write_tiff(filenames[-1], [(frame, False) for frame in frames])
+    frame_files = ptagtool.FrameFiles(max_files=2)
+    errors = []
+
+    def load(seed):
+        """Decode frames in random order, record mismatches"""
+        rng = numpy.random.RandomState(seed)
+        for _ in range(50):
+            filename = filenames[rng.randint(len(filenames))]
+            page = rng.randint(len(frames))
+            image, _ = frame_files.load_frame(filename, page)
+            if not numpy.array_equal(numpy.asarray(image),
+                                     numpy.asarray(frames[page])):
+                errors.append((filename, page))
+
+    threads = [threading.Thread(target=load, args=(seed,))
+               for seed in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    frame_files.close()
+    assert errors == []
+    assert len(frame_files.files) == 0
+
+def test_points_are_saved_per_frame(tmp_path):
+    """Each frame has a .pts file of its own"""
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(frame, False) for frame in make_frames(2)])
+    store = ptagtool.PtsFileStore()
+    store.write_points(str(tmp_path/'stack.tif[000001]'), [[1, 2]])
+    assert (tmp_path/'stack.tif[000001].pts').exists()
+    assert store.read_points(str(tmp_path/'stack.tif[000000]')) == []
+    assert store.read_points(str(tmp_path/'stack.tif[000001]')) == [[1, 2]]
+    filenames, manifest = ptagtool.scan_image_files(str(tmp_path))
+    assert [manifest.has_pts_file(filename)
+            for filename in filenames] == [False, True]
+
+def test_pyramid_tiff_is_decoded_from_reduced_page(tmp_path):
+    """A single image with reduced-resolution pages is decoded from the
+    smallest one large enough"""
+    image = make_frames(1, (400, 300))[0]
+    write_tiff(str(tmp_path/'pyramid.tif'),
+               [(image, False), (image.resize((200, 150)), True),
+                (image.resize((100, 75)), True)])
+    decoded, image_size = ptagtool.open_image(str(tmp_path/'pyramid.tif'),
+                                              (90, 60))
+    with decoded:
+        decoded.load()
+        assert decoded.size == (100, 75)
+        assert image_size == (400, 300)
+
+def test_frames_are_validated_against_their_own_size(tmp_path, capsys):
+    """Frames of different sizes in a stack each have their own bounds"""
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(make_frames(1, (100, 80))[0], False),
+                (make_frames(1, (40, 30))[0], False)])
+    store = ptagtool.PtsFileStore()
+    store.write_points(str(tmp_path/'stack.tif[000000]'), [[90, 70]])
+    store.write_points(str(tmp_path/'stack.tif[000001]'), [[50, 10]])
+    filenames, manifest = ptagtool.scan_image_files(str(tmp_path))
+    assert [manifest.get_image_size(filename)
+            for filename in filenames] == [(100, 80), (40, 30)]
+    with pytest.raises(SystemExit):
+        ptagtool.batch_main(['validate', str(tmp_path), '--jobs', '1'])
+    output = capsys.readouterr().out
+    assert 'stack.tif[000001]: point 1 (50.0, 10.0) is outside the 40x30' \
+        in output
+    assert 'stack.tif[000000]:' not in output
+
+def test_legacy_pts_file_is_read_as_first_frame(tmp_path):
+    """A multi-frame file tagged as a single image keeps its points, as
+    those of its first frame, until the frame's own points are saved"""
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(frame, False) for frame in make_frames(2)])
+    (tmp_path/'stack.pts').write_text('1, 2\n')
+    filenames, manifest = ptagtool.scan_image_files(str(tmp_path))
+    # scanning does not touch the dataset
+    assert (tmp_path/'stack.pts').exists()
+    assert manifest.has_pts_file(filenames[0])
+    assert not manifest.has_pts_file(filenames[1])
+    store = ptagtool.PtsFileStore()
+    assert store.has_points(filenames[0])
+    assert not store.has_points(filenames[1])
+    assert store.read_points(filenames[0]) == [[1.0, 2.0]]
+    store.write_points(filenames[0], [[3, 4]])
+    assert not (tmp_path/'stack.pts').exists()
+    assert store.read_points(filenames[0]) == [[3.0, 4.0]]
+    # removing the frame's points does not bring the old ones back
+    (tmp_path/'stack.pts').write_text('1, 2\n')
+    store.write_points(filenames[0], [])
+    assert not (tmp_path/'stack.pts').exists()
+    assert not store.has_points(filenames[0])
+
+def test_ambiguous_legacy_pts_file_is_left_alone(tmp_path):
+    """A .pts file that may be another image's is not the first frame's"""
+    frames = make_frames(2)
+    write_tiff(str(tmp_path/'stack.tif'),
+               [(frame, False) for frame in frames])
+    frames[0].save(str(tmp_path/'stack.png'))
+    (tmp_path/'stack.pts').write_text('1, 2\n')
+    filenames, manifest = ptagtool.scan_image_files(str(tmp_path))
+    first = str(tmp_path/'stack.tif[000000]')
+    assert manifest.has_pts_file(str(tmp_path/'stack.png'))
+    assert not manifest.has_pts_file(first)
+    assert len(filenames) == 3
+    store = ptagtool.PtsFileStore()
+    assert not store.has_points(first)
+    store.write_points(first, [[3, 4]])
+    assert (tmp_path/'stack.pts').read_text() == '1, 2\n'
+    assert store.read_points(str(tmp_path/'stack.png')) == [[1.0, 2.0]]
+
+def test_legacy_database_key_is_read_as_first_frame(tmp_path):
+    """Points saved under a multi-frame file's key are those of its first
+    frame, until the frame's own points are saved"""
+    path = str(tmp_path)
+    store = ptagtool.SqliteStore(str(tmp_path/'points.sqlite'), path)
+    store.write_points(str(tmp_path/'stack.tif'), [[1, 2]])
+    first = str(tmp_path/'stack.tif[000000]')
+    second = str(tmp_path/'stack.tif[000001]')
+    assert store.has_points(first)
+    assert not store.has_points(second)
+    assert store.read_points(first) == [[1.0, 2.0]]
+    assert store.find_labeled([first, second]) == set([first])
+    store.write_points(first, [[3, 4]])
+    assert store.read_points(first) == [[3.0, 4.0]]
+    assert not store.has_points(str(tmp_path/'stack.tif'))
+    # removing the frame's points does not bring the old ones back
+    store.write_points(first, [])
+    assert not store.has_points(first)
+    store.close()
@@ -0,0 +1,105 @@
+"""Tests of the scan manifest"""
+
+import os
+import time
+
+import PIL.Image
+
+import ptagtool
+
+def make_image(filename, size=(8, 6)):
+    """Write a small PNG image"""
+    PIL.Image.new('L', size).save(filename)
+
+def age(path, seconds=60):
+    """Set modification time of path to some seconds ago, so that the
+    manifest trusts it"""
+    mtime = time.time()-seconds
+    os.utime(path, (mtime, mtime))
+
+def rescan(path, monkeypatch):
+    """Scan path with a manifest loaded from disk, returns (image
+    filenames, manifest, list of files probed)"""
+    probed = []
+    probe_image = ptagtool.probe_image
+
+    def counting_probe(filename):
+        """Record and probe filename"""
+        probed.append(filename)
+        return probe_image(filename)
+
+    monkeypatch.setattr(ptagtool, 'probe_image', counting_probe)
+    manifest = ptagtool.ImageManifest(path)
+    manifest.load()
+    filenames = manifest.scan()
+    manifest.save()
+    return filenames, manifest, probed
+
+def test_unchanged_directory_is_not_probed_again(tmp_path, monkeypatch):
+    """Restarts on an unchanged tree reuse the manifest"""
+    make_image(str(tmp_path/'a.png'))
+    age(str(tmp_path))
+    filenames, _, probed = rescan(str(tmp_path), monkeypatch)
+    assert filenames == [str(tmp_path/'a.png')]
+    assert probed == [str(tmp_path/'a.png')]
+    filenames, _, probed = rescan(str(tmp_path), monkeypatch)
+    assert filenames == [str(tmp_path/'a.png')]
+    assert probed == []
+
+def test_changed_directory_is_revalidated(tmp_path, monkeypatch):
+    """New files are found, and only they are probed"""
+    make_image(str(tmp_path/'a.png'))
+    age(str(tmp_path))
+    rescan(str(tmp_path), monkeypatch)
+    make_image(str(tmp_path/'b.png'), (5, 4))
+    age(str(tmp_path), 30)
+    filenames, manifest, probed = rescan(str(tmp_path), monkeypatch)
+    assert filenames == [str(tmp_path/'a.png'), str(tmp_path/'b.png')]
+    assert probed == [str(tmp_path/'b.png')]
+    assert manifest.get_image_size(str(tmp_path/'b.png')) == (5, 4)
+
+def test_modified_file_is_probed_again(tmp_path, monkeypatch):
+    """A file whose size changed is probed again, in an unchanged folder"""
+    make_image(str(tmp_path/'a.png'))
+    age(str(tmp_path))
+    rescan(str(tmp_path), monkeypatch)
+    make_image(str(tmp_path/'a.png'), (40, 30))
+    age(str(tmp_path), 30)
+    _, manifest, probed = rescan(str(tmp_path), monkeypatch)
+    assert probed == [str(tmp_path/'a.png')]
+    assert manifest.get_image_size(str(tmp_path/'a.png')) == (40, 30)
+
+def test_pts_files_are_noticed(tmp_path, monkeypatch):
+    """Adding or removing a .pts file changes what the manifest reports"""
+    make_image(str(tmp_path/'a.png'))
+    age(str(tmp_path))
+    _, manifest, _ = rescan(str(tmp_path), monkeypatch)
+    assert not manifest.has_pts_file(str(tmp_path/'a.png'))
+    ptagtool.PtsFileStore().write_points(str(tmp_path/'a.png'), [[1, 2]])
+    age(str(tmp_path), 30)
+    _, manifest, probed = rescan(str(tmp_path), monkeypatch)
+    assert manifest.has_pts_file(str(tmp_path/'a.png'))
+    assert probed == []
+    os.remove(str(tmp_path/'a.pts'))
+    age(str(tmp_path), 20)
+    _, manifest, _ = rescan(str(tmp_path), monkeypatch)
+    assert not manifest.has_pts_file(str(tmp_path/'a.png'))
+
+def test_recent_directory_is_always_revalidated(tmp_path, monkeypatch):
+    """Folders modified just before a scan are not trusted"""
+    make_image(str(tmp_path/'a.png'))
+    rescan(str(tmp_path), monkeypatch)
+    make_image(str(tmp_path/'b.png'))
+    # same mtime as before, as on file systems with coarse mtimes
+    filenames, _, _ = rescan(str(tmp_path), monkeypatch)
+    assert filenames == [str(tmp_path/'a.png'), str(tmp_path/'b.png')]
+
+def test_links_inside_root_are_listed_once(tmp_path, monkeypatch):
+    """Folders linked to from inside the root are listed by real path"""
+    os.mkdir(str(tmp_path/'a'))
+    os.mkdir(str(tmp_path/'b'))
+    make_image(str(tmp_path/'b'/'x.png'))
+    os.symlink(os.path.join('..', 'b'), str(tmp_path/'a'/'link'))
+    filenames, _, _ = rescan(str(tmp_path), monkeypatch)
+    assert filenames == [str(tmp_path/'b'/'x.png')]
+    assert ptagtool.find_image_files(str(tmp_path)) == filenames
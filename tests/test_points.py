@@ -0,0 +1,46 @@
+"""Tests of point arrays and nearest-point lookups"""
+
+import numpy
+
+import ptagtool
+
+def test_find_nearest_point():
+    """The nearest point within the radius is found, or -1"""
+    points = ptagtool.points_to_array([[10, 10], [20, 10], [100, 100]])
+    assert ptagtool.find_nearest_point(points, 12, 11, 5) == 0
+    assert ptagtool.find_nearest_point(points, 18, 10, 5) == 1
+    assert ptagtool.find_nearest_point(points, 50, 50, 5) == -1
+    assert ptagtool.find_nearest_point(ptagtool.points_to_array([]),
+                                       0, 0, 5) == -1
+
+def test_find_nearest_point_after_insert_and_delete():
+    """Lookups see points added and removed as clicks do"""
+    points = ptagtool.points_to_array([[10, 10], [20, 10]])
+    points = numpy.vstack([points, [30, 10]])
+    assert ptagtool.find_nearest_point(points, 29, 10, 5) == 2
+    points = numpy.delete(points, 0, axis=0)
+    assert ptagtool.find_nearest_point(points, 10, 10, 5) == -1
+    assert ptagtool.find_nearest_point(points, 21, 10, 5) == 0
+    assert ptagtool.find_nearest_point(points, 29, 10, 5) == 1
+    points = numpy.vstack([points, [10, 10]])
+    assert ptagtool.find_nearest_point(points, 11, 10, 5) == 2
+
+def test_find_nearest_point_matches_brute_force():
+    """Dense random point sets give the same answer as a plain search"""
+    rng = numpy.random.RandomState(0)
+    points = rng.uniform(0, 1000, (2000, 2))
+    for x_coord, y_coord in rng.uniform(0, 1000, (200, 2)):
+        distances = [numpy.hypot(x-x_coord, y-y_coord) for x, y in points]
+        expected = int(numpy.argmin(distances))
+        if distances[expected] > 20:
+            expected = -1
+        assert ptagtool.find_nearest_point(points, x_coord, y_coord,
+                                           20) == expected
+
+def test_transform_round_trip():
+    """Canvas coordinates map back to the same original coordinates"""
+    points = ptagtool.points_to_array([[0.5, 1.25], [1000.0, 750.0]])
+    canvas = ptagtool.transform_points(points, 0.2, 7.0, 3.0)
+    assert numpy.allclose(canvas[1], [207.0, 153.0])
+    assert numpy.allclose(
+        ptagtool.inverse_transform_points(canvas, 0.2, 7.0, 3.0), points)
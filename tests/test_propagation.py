@@ -0,0 +1,60 @@
+"""Tests of predicting points by template matching"""
+
+import numpy
+import PIL.Image
+
+import ptagtool
+
+def make_texture(size, seed=0):
+    """Returns 2D float32 array of smooth random texture"""
+    noise = numpy.random.RandomState(seed).uniform(
+        0, 255, (size[1]//4, size[0]//4)).astype(numpy.float32)
+    return numpy.asarray(PIL.Image.fromarray(noise).resize(
+        size, PIL.Image.BICUBIC))
+
+def test_known_shift_is_recovered():
+    """Points of an image shifted by a few pixels are found shifted, to
+    within a tenth of a pixel"""
+    image = make_texture((320, 240))
+    # 4 pixels down, 7 pixels left
+    next_image = numpy.roll(image, (4, -7), axis=(0, 1))
+    points = numpy.array([[100.0, 80.0], [200.0, 150.0], [160.0, 120.0]])
+    matched, scores = ptagtool.match_points(image, next_image, points)
+    assert numpy.allclose(matched, points+[-7, 4], atol=0.1)
+    assert numpy.all(scores > 0.99)
+
+def test_brightness_change_does_not_matter():
+    """Matching is normalized, so a brighter, contrastier frame matches"""
+    image = make_texture((320, 240))
+    next_image = numpy.roll(image, (-3, 5), axis=(0, 1))*1.5+20
+    points = numpy.array([[150.0, 100.0]])
+    matched, scores = ptagtool.match_points(image, next_image, points)
+    assert numpy.allclose(matched, points+[5, -3], atol=0.1)
+    assert scores[0] > 0.99
+
+def test_unrelated_image_scores_low():
+    """Points of an image that is not the next frame match poorly"""
+    image = make_texture((320, 240), seed=0)
+    next_image = make_texture((320, 240), seed=1)
+    points = numpy.array([[100.0, 80.0], [200.0, 150.0]])
+    _, scores = ptagtool.match_points(image, next_image, points)
+    assert numpy.all(scores < ptagtool.MIN_MATCH_SCORE)
+
+def test_propagator_keeps_poor_matches(tmp_path):
+    """Points that match well move, those that do not stay put"""
+    image = make_texture((320, 240))
+    next_image = numpy.roll(image, (2, 3), axis=(0, 1))
+    # wipe out the surroundings of the second point in the next frame
+    next_image[130:170, 180:220] = 0
+    filenames = [str(tmp_path/'0.png'), str(tmp_path/'1.png')]
+    for filename, pixels in zip(filenames, [image, next_image]):
+        PIL.Image.fromarray(pixels.astype(numpy.uint8)).save(filename)
+    propagator = ptagtool.PointPropagator()
+    try:
+        predicted = propagator.predict(filenames[0],
+                                       [[100.0, 80.0], [200.0, 150.0]],
+                                       filenames[1]).result()
+    finally:
+        propagator.shutdown()
+    assert numpy.allclose(predicted[0], [103.0, 82.0], atol=0.1)
+    assert numpy.allclose(predicted[1], [200.0, 150.0])
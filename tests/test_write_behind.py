@@ -0,0 +1,105 @@
+"""Tests of saving points in the background"""
+
+import threading
+import time
+
+import ptagtool
+
+class RecordingStore(object):
+    """Annotation store that keeps points in memory and records calls"""
+    def __init__(self, delay=0.0):
+        """Constructor"""
+        self.delay = delay
+        self.points = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def has_points(self, image_filename):
+        """Returns whether image has saved points"""
+        return image_filename in self.points
+
+    def find_labeled(self, image_filenames):
+        """Returns set of given image filenames that have saved points"""
+        return set(image_filename for image_filename in image_filenames
+                   if image_filename in self.points)
+
+    def read_points(self, image_filename):
+        """Returns list of points saved for image"""
+        return self.points.get(image_filename, [])
+
+    def write_points(self, image_filename, points):
+        """Save points for image, slowly"""
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls.append(('write', image_filename, points))
+            if points:
+                self.points[image_filename] = points
+            else:
+                self.points.pop(image_filename, None)
+
+    def close(self):
+        """Record closing"""
+        with self.lock:
+            self.calls.append(('close',))
+
+def test_edits_are_coalesced():
+    """Rapid edits of an image are saved once, with the latest points"""
+    store = RecordingStore()
+    writer = ptagtool.WriteBehindStore(store, delay=0.2)
+    for i in range(10):
+        writer.write_points('a.jpg', [[i, i]])
+    writer.flush()
+    assert store.calls == [('write', 'a.jpg', [[9, 9]])]
+    writer.close()
+
+def test_unsaved_points_are_visible():
+    """Points not yet saved are read back from the queue"""
+    store = RecordingStore()
+    store.points['b.jpg'] = [[1, 1]]
+    writer = ptagtool.WriteBehindStore(store, delay=60)
+    writer.write_points('a.jpg', [[1, 2]])
+    writer.write_points('b.jpg', [])
+    assert writer.read_points('a.jpg') == [[1, 2]]
+    assert writer.has_points('a.jpg')
+    assert not writer.has_points('b.jpg')
+    assert writer.find_labeled(['a.jpg', 'b.jpg', 'c.jpg']) == set(['a.jpg'])
+    assert store.calls == []
+    writer.close()
+
+def test_close_saves_everything_before_closing_the_store():
+    """Shutting down saves all queued points, then closes the store"""
+    store = RecordingStore(delay=0.05)
+    writer = ptagtool.WriteBehindStore(store, delay=60)
+    for i in range(5):
+        writer.write_points('%d.jpg' % i, [[i, i]])
+    writer.write_points('2.jpg', [[7, 7]])
+    writer.close()
+    assert store.calls[-1] == ('close',)
+    assert sorted(store.calls[:-1]) == [('write', '%d.jpg' % i,
+                                         [[7, 7]] if i == 2 else [[i, i]])
+                                        for i in range(5)]
+    assert not writer.thread.is_alive()
+
+def test_flush_waits_for_write_in_progress():
+    """flush() returns only once points being written are saved"""
+    store = RecordingStore(delay=0.3)
+    writer = ptagtool.WriteBehindStore(store, delay=0.0)
+    writer.write_points('a.jpg', [[1, 2]])
+    # let the background thread pick the points up
+    time.sleep(0.1)
+    writer.flush()
+    assert store.points == {'a.jpg': [[1, 2]]}
+    writer.close()
+
+def test_edit_during_write_is_saved_after_it():
+    """An edit made while the image is being saved is saved later, so the
+    latest points win"""
+    store = RecordingStore(delay=0.2)
+    writer = ptagtool.WriteBehindStore(store, delay=0.0)
+    writer.write_points('a.jpg', [[1, 1]])
+    time.sleep(0.1)
+    writer.write_points('a.jpg', [[2, 2]])
+    assert writer.read_points('a.jpg') == [[2, 2]]
+    writer.close()
+    assert store.points == {'a.jpg': [[2, 2]]}
+    assert [call[2] for call in store.calls[:-1]] == [[[1, 1]], [[2, 2]]]